@@ -11,11 +11,66 @@ class Settings(BaseSettings):
     base_url: str = "http://localhost:8023"
     mailgun_api_key: str = ""
     mailgun_domain: str = ""
+    email_transport: str = "mailgun"  # "mailgun" or "fake"
+    email_concurrency: int = 4
+    email_max_retries: int = 3
+    email_retry_backoff_seconds: float = 1.0
+    email_dedupe_seconds: int = 60
+    email_timeout_seconds: float = 10.0
     jwt_algorithm: str = "HS256"
     frontend_url: str = "https://app.xtransform.org"
     sentry_url: str = ""
     session_expiry: int = 7 * 24 * 60 * 60  # 1 Week
+    session_backend: str = "mongo"  # "mongo" or "signed"
+    revocation_refresh_seconds: int = 30
+    session_cache_size: int = 10000
+    session_cache_ttl: int = 60
     redis_url: str = "redis://redis:6379"
+    simplify_tolerance_pixels: float = 1.0
+    simplify_max_zoom: int = 18
+    simplified_geometry_cache_size: int = 50000
+    tile_extent: int = 4096
+    tile_buffer: int = 64
+    # Lower zoom tiles span a hemisphere, which $geoIntersects cannot query
+    tile_min_zoom: int = 2
+    tile_max_age: int = 5 * 60  # 5 minutes
+    cache_backend: str = "memory"  # "memory", "redis" or "none"
+    cache_max_entries: int = 2048
+    cache_ttl: int = 60 * 60  # 1 hour
+    cache_min_zoom: int = 10
+    cache_max_zoom: int = 16
+    cache_max_tiles: int = 16
+    cache_brotli_quality: int = 9
+    cache_zstd_level: int = 19
+    cache_gzip_level: int = 9
+    # On the fly compression of uncached responses, favouring speed
+    compression_minimum_size: int = 500
+    compression_brotli_quality: int = 4
+    compression_zstd_level: int = 3
+    compression_gzip_level: int = 6
+    stream_batch_size: int = 500
+    page_max_limit: int = 1000
+    bulk_chunk_size: int = 500
+    rate_limit_backend: str = "memory"  # "memory" or "redis"
+    rate_limit_max_keys: int = 100000
+    # Only behind a proxy that sets X-Forwarded-For, clients can forge it otherwise
+    trust_forwarded_for: bool = False
+    magic_link_ip_limit: str = "20/hour"
+    magic_link_email_limit: str = "5/hour"
+    tombstone_ttl: int = 30 * 24 * 60 * 60  # 30 days
+    ensure_indexes_on_startup: bool = True
+    slow_index_build_seconds: float = 1.0
+    cluster_simplify_tolerance: float = 0.0003  # degrees, roughly 20-30m
+    live_batch_seconds: float = 0.5
+    live_poll_seconds: float = 2.0
+    # Writes are stamped by the clock of the process writing them, pollers
+    # read this far behind the latest timestamp seen to catch slower clocks
+    poll_lookback_seconds: float = 10.0
+    live_geometry_cache_size: int = 50000
+    # Answer summary bbox queries from an in-process copy of the segments
+    segment_replica_enabled: bool = False
+    segment_replica_reconcile_seconds: float = 30.0
+    segment_replica_rebuild_threshold: int = 1000
 
     class Config:
         env_file = ".env"
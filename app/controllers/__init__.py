@@ -1,3 +1,19 @@
-from .users import get_user_by_email, get_user, create_user, create_session, get_logged_in_user, clear_session  # noqa
-from .segments import (create_segment, get_segments, delete_segment, get_segment, update_segment, query_segments) # noqa
+from .users import get_user_by_email, get_user, create_user, create_session, get_logged_in_user, clear_session, delete_undated_sessions, update_user_permission  # noqa
+from .segments import (  # noqa
+    create_segment,
+    get_segments,
+    delete_segment,
+    get_segment,
+    update_segment,
+    query_segments,
+    stream_segments,
+    bulk_upsert_segments,
+    patch_segment,
+    patch_subsegment,
+    live_feed,
+    segment_replica,
+)
 from .clusters import get_clusters  # noqa
+from .tiles import get_segment_tile  # noqa
+from .exports import write_parquet  # noqa
+from .statistics import get_statistics  # noqa
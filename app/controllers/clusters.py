@@ -1,15 +1,101 @@
-from ..services import db
+from collections import defaultdict
+from typing import Iterable, Optional, Tuple
+
+from ..geo import first_coordinate
+from ..services import db, response_cache
 
 cluster_collection = db['clusters']
+cluster_stats_collection = db['cluster_stats']
 
 
-async def get_clusters() -> dict:
+async def get_clusters(full_geometry: bool = False) -> dict:
     clusters = []
-    async for cluster in cluster_collection.find():
+    geometry = '$geometry'
+    if not full_geometry:
+        geometry = {'$ifNull': ['$display_geometry', '$geometry']}
+    async for cluster in cluster_collection.aggregate([
+        {'$project': {
+            'type': 1,
+            'name': 1,
+            'bbox': 1,
+            'centroid': 1,
+            'geometry': geometry,
+        }},
+        {'$lookup': {
+            'from': 'cluster_stats',
+            'localField': '_id',
+            'foreignField': '_id',
+            'as': 'stats',
+        }},
+    ]):
+        stats = cluster.pop('stats')
+        stats = stats[0] if stats else {}
+        centroid = cluster.pop('centroid', None)
         cluster['properties'] = {}
         cluster['properties']['name'] = cluster['name']
+        cluster['properties']['centroid'] = centroid and centroid['coordinates']
+        cluster['properties']['count'] = stats.get('car_count', 0)
+        cluster['properties']['segment_count'] = stats.get('segment_count', 0)
+        cluster['properties']['length_in_meters'] = stats.get('length_in_meters', 0)
+        cluster['properties']['parking_allowed'] = stats.get('parking_allowed', {})
         clusters.append(cluster)
     return {
         'type': 'FeatureCollection',
         'features': clusters
     }
+
+
+async def find_cluster_id(geometry: dict) -> Optional[str]:
+    # A segment is counted in the cluster containing its first point, so
+    # segments crossing a district border are not counted twice
+    cluster = await cluster_collection.find_one(
+        {'geometry': {'$geoIntersects': {'$geometry': {
+            'type': 'Point',
+            'coordinates': first_coordinate(geometry),
+        }}}},
+        {'_id': 1},
+    )
+    return cluster['_id'] if cluster else None
+
+
+def segment_stats(segment: dict) -> dict:
+    """Contribution of a segment to its cluster, as dotted stats fields."""
+    stats = defaultdict(int)
+    stats['segment_count'] = 1
+    for subsegment in segment['properties'].get('subsegments', []):
+        allowed = 'allowed' if subsegment.get('parking_allowed') else 'not_allowed'
+        car_count = subsegment.get('car_count')
+        if car_count is None:
+            car_count = subsegment.get('estimated_car_count') or 0
+        length = subsegment.get('length_in_meters') or 0
+        stats['car_count'] += car_count
+        stats['length_in_meters'] += length
+        stats[f'parking_allowed.{allowed}.car_count'] += car_count
+        stats[f'parking_allowed.{allowed}.length_in_meters'] += length
+        stats[f'parking_allowed.{allowed}.subsegment_count'] += 1
+    return stats
+
+
+async def update_cluster_stats(
+    changes: Iterable[Tuple[Optional[dict], Optional[dict]]]
+):
+    """Apply the difference between old and new segment versions to cluster_stats."""
+    increments = defaultdict(lambda: defaultdict(int))
+    for old, new in changes:
+        for segment, sign in ((old, -1), (new, 1)):
+            cluster_id = segment and segment['properties'].get('cluster_id')
+            if cluster_id is None:
+                continue
+            for field, value in segment_stats(segment).items():
+                increments[cluster_id][field] += sign * value
+
+    changed = False
+    for cluster_id, fields in increments.items():
+        fields = {field: value for field, value in fields.items() if value}
+        if fields:
+            await cluster_stats_collection.update_one(
+                {'_id': cluster_id}, {'$inc': fields}, upsert=True
+            )
+            changed = True
+    if changed:
+        await response_cache.invalidate(['clusters'])
@@ -0,0 +1,84 @@
+from typing import List, Optional
+
+import numpy as np
+from shapely.geometry import shape
+
+from .. import schemas
+from ..geo import geometry_lengths
+
+Alignment = schemas.segment.Alignment
+
+# Curb length taken up by one parked car, including the gap to the next one
+CAR_SPACING_METERS = {
+    Alignment.parallel.value: 5.7,
+    Alignment.diagonal.value: 3.1,
+    Alignment.perpendicular.value: 2.5,
+}
+
+
+def estimate_car_counts(
+    lengths: np.ndarray, alignments: List[Optional[str]]
+) -> np.ndarray:
+    """Cars fitting along each length, NaN where the length is unknown."""
+    default = CAR_SPACING_METERS[Alignment.parallel.value]
+    spacing = np.array([
+        CAR_SPACING_METERS.get(getattr(alignment, 'value', alignment), default)
+        for alignment in alignments
+    ])
+    return np.floor(np.asarray(lengths, dtype=float) / spacing)
+
+
+def derive_fields(segments: List[dict]) -> List[dict]:
+    """
+    Set the fields derived from geometry and subsegments, in place.
+
+    Segments get a GeoJSON bbox and their geodesic length_in_meters.
+    Subsegments where parking is allowed but car_count is unknown get an
+    estimated_car_count from their length and alignment.
+    """
+    lengths = geometry_lengths([segment['geometry'] for segment in segments])
+    for segment, length in zip(segments, lengths):
+        segment['bbox'] = list(shape(segment['geometry']).bounds)
+        segment['properties']['length_in_meters'] = length
+
+    derive_subsegment_fields([
+        subsegment
+        for segment in segments
+        for subsegment in segment['properties'].get('subsegments') or []
+    ])
+    return segments
+
+
+def derive_subsegment_fields(subsegments: List[dict]) -> List[dict]:
+    """Set the estimated_car_count of subsegments, in place."""
+    if not subsegments:
+        return subsegments
+    estimates = estimate_car_counts(
+        np.array(
+            [subsegment.get('length_in_meters') for subsegment in subsegments],
+            dtype=float,
+        ),
+        [subsegment.get('alignment') for subsegment in subsegments],
+    )
+    for subsegment, estimate in zip(subsegments, estimates):
+        needs_estimate = (
+            subsegment.get('parking_allowed')
+            and subsegment.get('car_count') is None
+            and not np.isnan(estimate)
+        )
+        subsegment['estimated_car_count'] = int(estimate) if needs_estimate else None
+    return subsegments
+
+
+def derived_field_updates(segment: dict) -> dict:
+    """$set fields storing what derive_fields computed for segment."""
+    fields = {
+        'bbox': segment['bbox'],
+        'properties.length_in_meters': segment['properties']['length_in_meters'],
+    }
+    subsegments = segment['properties'].get('subsegments') or []
+    for position, subsegment in enumerate(subsegments):
+        fields[f'properties.subsegments.{position}.estimated_car_count'] = (
+            subsegment['estimated_car_count']
+        )
+    return fields
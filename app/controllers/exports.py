@@ -0,0 +1,229 @@
+import enum
+import logging
+from typing import Any, BinaryIO, Dict, List, Optional
+
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from pydantic.fields import SHAPE_LIST
+from shapely.errors import GEOSException
+from shapely.geometry import shape
+from starlette.concurrency import run_in_threadpool
+
+from .. import schemas
+from ..config import settings
+from .segments import segment_collection
+
+logger = logging.getLogger(__name__)
+
+_scalar_types = {
+    bool: pa.bool_(),
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+}
+
+
+# Every enum has fewer than 128 values, int8 codes are plenty
+_enum_type = pa.dictionary(pa.int8(), pa.string())
+
+
+def _field_type(field) -> pa.DataType:
+    if issubclass(field.type_, enum.Enum):
+        value_type = _enum_type
+    else:
+        value_type = _scalar_types[field.type_]
+    return pa.list_(value_type) if field.shape == SHAPE_LIST else value_type
+
+
+SEGMENT_SCHEMA = pa.schema(
+    [
+        ('id', pa.string()),
+        ('geometry', pa.binary()),
+        ('owner_id', pa.string()),
+        ('cluster_id', pa.string()),
+        ('data_source', pa.string()),
+        ('further_comments', pa.string()),
+        ('created_at', pa.timestamp('ms')),
+        ('modified_at', pa.timestamp('ms')),
+        ('version', pa.int64()),
+        ('length_in_meters', pa.float64()),
+        ('subsegment_count', pa.int32()),
+    ],
+    metadata={
+        'geo': orjson.dumps({
+            'version': '1.0.0',
+            'primary_column': 'geometry',
+            'columns': {
+                'geometry': {
+                    'encoding': 'WKB',
+                    'geometry_types': [],
+                },
+            },
+        }),
+    },
+)
+
+# One row per subsegment, joined to the segments on segment_id
+SUBSEGMENT_SCHEMA = pa.schema(
+    [('segment_id', pa.string())]
+    + [
+        (name, _field_type(field))
+        for name, field in schemas.segment.Subsegment.__fields__.items()
+    ]
+)
+
+
+def _array(
+    values: List[Any], type_: pa.DataType, name: str, segment_ids: List[str]
+) -> pa.Array:
+    """
+    Convert a column, values that do not fit its type become null.
+
+    Stored segments are not validated, one bad value must not fail the
+    whole export.
+    """
+    try:
+        return pa.array(values, type=type_)
+    except (pa.ArrowException, OverflowError):
+        pass
+    coerced = []
+    for value, segment_id in zip(values, segment_ids):
+        try:
+            pa.array([value], type=type_)
+        except (pa.ArrowException, OverflowError):
+            logger.warning(
+                f"Exporting {name} of segment {segment_id} as null, "
+                f"invalid value {value!r}"
+            )
+            value = None
+        coerced.append(value)
+    return pa.array(coerced, type=type_)
+
+
+def _code(codes: Dict[Any, int], value: Any) -> Optional[int]:
+    try:
+        return codes.get(value)
+    except TypeError:
+        # Unhashable, eg. a list where a single value belongs
+        return None
+
+
+def _dictionary_array(values: List[Any], enum_type: enum.EnumMeta) -> pa.Array:
+    """Encode with the enum's own dictionary, unknown values become null."""
+    dictionary = [member.value for member in enum_type]
+    codes = {value: code for code, value in enumerate(dictionary)}
+    return pa.DictionaryArray.from_arrays(
+        pa.array([_code(codes, value) for value in values], type=pa.int8()),
+        pa.array(dictionary, type=pa.string()),
+    )
+
+
+def _subsegment_column(
+    name: str, values: List[Any], segment_ids: List[str]
+) -> pa.Array:
+    field = schemas.segment.Subsegment.__fields__[name]
+    if not issubclass(field.type_, enum.Enum):
+        return _array(values, SUBSEGMENT_SCHEMA.field(name).type, name, segment_ids)
+    if field.shape != SHAPE_LIST:
+        return _dictionary_array(values, field.type_)
+    lists = [value if isinstance(value, list) else [] for value in values]
+    offsets = [0]
+    for value in lists:
+        offsets.append(offsets[-1] + len(value))
+    return pa.ListArray.from_arrays(
+        pa.array(offsets, type=pa.int32()),
+        _dictionary_array([item for value in lists for item in value], field.type_),
+    )
+
+
+def _wkb(segment: dict) -> Optional[bytes]:
+    try:
+        return shapely.to_wkb(shape(segment['geometry']))
+    except (AttributeError, GEOSException, KeyError, TypeError, ValueError):
+        logger.warning(f"Exporting geometry of segment {segment['_id']} as null")
+        return None
+
+
+def _subsegments(segment: dict) -> list:
+    subsegments = segment['properties'].get('subsegments')
+    return subsegments if isinstance(subsegments, list) else []
+
+
+def segment_batch(segments: List[dict]) -> pa.RecordBatch:
+    segment_ids = [str(segment['_id']) for segment in segments]
+    columns = {
+        'id': segment_ids,
+        'geometry': [_wkb(segment) for segment in segments],
+        'subsegment_count': [len(_subsegments(segment)) for segment in segments],
+    }
+    for name in SEGMENT_SCHEMA.names:
+        if name not in columns:
+            columns[name] = [segment['properties'].get(name) for segment in segments]
+    return pa.RecordBatch.from_arrays(
+        [
+            _array(columns[field.name], field.type, field.name, segment_ids)
+            for field in SEGMENT_SCHEMA
+        ],
+        schema=SEGMENT_SCHEMA,
+    )
+
+
+def subsegment_batch(segments: List[dict]) -> pa.RecordBatch:
+    rows = [
+        (str(segment['_id']), subsegment)
+        for segment in segments
+        for subsegment in _subsegments(segment)
+        if isinstance(subsegment, dict)
+    ]
+    segment_ids = [segment_id for segment_id, _ in rows]
+    columns = {'segment_id': pa.array(segment_ids, type=pa.string())}
+    for name, field in schemas.segment.Subsegment.__fields__.items():
+        columns[name] = _subsegment_column(
+            name,
+            [subsegment.get(name, field.default) for _, subsegment in rows],
+            segment_ids,
+        )
+    return pa.RecordBatch.from_pydict(columns, schema=SUBSEGMENT_SCHEMA)
+
+
+_tables = {
+    schemas.ExportTable.segments: (SEGMENT_SCHEMA, segment_batch),
+    schemas.ExportTable.subsegments: (SUBSEGMENT_SCHEMA, subsegment_batch),
+}
+
+
+async def write_parquet(
+    sinks: Dict[schemas.ExportTable, BinaryIO],
+    batch_size: int = settings.stream_batch_size,
+):
+    """
+    Write the segments collection as Parquet, one batch at a time.
+
+    The segments table is GeoParquet with WKB geometries. The subsegments
+    are flattened into their own table, with enum fields dictionary encoded.
+    Arrow conversion and compression run in the threadpool.
+    """
+    writers = {
+        table: pq.ParquetWriter(sink, _tables[table][0], compression='zstd')
+        for table, sink in sinks.items()
+    }
+
+    async def write(segments: List[dict]):
+        for table, writer in writers.items():
+            batch = await run_in_threadpool(_tables[table][1], segments)
+            await run_in_threadpool(writer.write_batch, batch)
+
+    try:
+        segments = []
+        async for segment in segment_collection.find().batch_size(batch_size):
+            segments.append(segment)
+            if len(segments) == batch_size:
+                await write(segments)
+                segments = []
+        if segments:
+            await write(segments)
+    finally:
+        for writer in writers.values():
+            await run_in_threadpool(writer.close)
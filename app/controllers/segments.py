@@ -1,44 +1,212 @@
+import asyncio
+import base64
+import binascii
+from collections import Counter
 from datetime import datetime
-from typing import List, Tuple, Optional
+from typing import Any, AsyncIterator, Iterable, List, Tuple, Optional
 from uuid import uuid4
 
+import numpy as np
+import orjson
+import shapely
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from geojson_pydantic.geometries import Geometry
+from pydantic import BaseModel, ValidationError, parse_obj_as
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
+from shapely.geometry import Polygon, shape
+
 from .. import schemas
-from ..permissions import user_can_operate
-from ..services import db
+from ..config import settings
+from ..geo import Bounds, geodesic_cover, simplify_lines, zoom_tolerance
+from ..permissions import access_levels, user_can_operate
+from ..strings import validation
+from .clusters import find_cluster_id, update_cluster_stats
+from .derived import derive_fields, derive_subsegment_fields
+from ..services import (
+    db, bump_counter, LiveFeed, LRUCache, response_cache, SegmentReplica
+)
 
 segment_collection = db['segments']
+deleted_segment_collection = db['deleted_segments']
+# segment id -> {'modified_at': datetime, 'zooms': {zoom bucket: coordinates}}
+simplified_geometry_cache = LRUCache(settings.simplified_geometry_cache_size)
+live_feed = LiveFeed(segment_collection, deleted_segment_collection)
+segment_replica = SegmentReplica(segment_collection, deleted_segment_collection)
+# MongoDB error code of a unique index violation
+DUPLICATE_KEY = 11000
 
 
-async def query_segments(
+def _segment_filter(
     bbox: List[Tuple[float, float]],
-    exclude_ids: List[str] = [],
-    include_if_modified_after: Optional[datetime] = None,
+    exclude_ids: List[str],
+    include_if_modified_after: Optional[datetime],
 ) -> dict:
-    features = []
-    async for feature in segment_collection.find({
+    query = {
         'geometry': {
             '$geoIntersects': {
                 '$geometry': {
-                    'type': "Polygon" ,
+                    'type': "Polygon",
                     'coordinates': [bbox]
                 }
             }
         }
-    }):
-        feature['properties']['has_subsegments'] = len(
-            feature['properties']['subsegments']
-        ) > 0
-        feature['properties']['subsegments'] = []
-        feature['id'] = feature['_id']
-        features.append(feature)
+    }
+    if exclude_ids:
+        # Segments the client already holds are only sent again if they
+        # changed after the client's last sync
+        not_held = {'_id': {'$nin': exclude_ids}}
+        if include_if_modified_after:
+            # Changed held segments are sent wherever they are now, so the
+            # client also moves those that left the bbox
+            return {'$or': [
+                {**query, **not_held},
+                {
+                    '_id': {'$in': exclude_ids},
+                    'properties.modified_at': {'$gt': include_if_modified_after},
+                },
+            ]}
+        query.update(not_held)
+    return query
+
+
+async def get_deleted_segment_ids(
+    segment_ids: List[str],
+    deleted_after: Optional[datetime] = None,
+) -> List[str]:
+    if not segment_ids:
+        return []
+    query = {'_id': {'$in': segment_ids}}
+    if deleted_after:
+        query['deleted_at'] = {'$gt': deleted_after}
+    return [
+        tombstone['_id']
+        async for tombstone in deleted_segment_collection.find(query, {'_id': 1})
+    ]
+
+
+def _summary_stage(details: bool) -> dict:
+    fields = {
+        'id': '$_id',
+        'properties.has_subsegments': {
+            '$gt': [{'$size': {'$ifNull': ['$properties.subsegments', []]}}, 0]
+        },
+    }
+    if not details:
+        # Drop the subsegment bodies inside Mongo so they never leave the server
+        fields['properties.subsegments'] = {'$literal': []}
+    return {'$addFields': fields}
+
+
+def _simplify_features(features: List[dict], zoom: float):
+    bucket = max(int(zoom), 0)
+    if bucket >= settings.simplify_max_zoom:
+        return
+
+    pending = []
+    for feature in features:
+        if feature['geometry']['type'] != 'LineString':
+            continue
+        modified_at = feature['properties'].get('modified_at')
+        cached = simplified_geometry_cache.get(feature['_id'])
+        if cached is None or cached['modified_at'] != modified_at:
+            cached = {'modified_at': modified_at, 'zooms': {}}
+            simplified_geometry_cache.set(feature['_id'], cached)
+        if bucket in cached['zooms']:
+            feature['geometry']['coordinates'] = cached['zooms'][bucket]
+        else:
+            pending.append((feature, cached))
+
+    simplified = simplify_lines(
+        [
+            np.asarray(feature['geometry']['coordinates'], dtype=float)[:, :2]
+            for feature, _ in pending
+        ],
+        zoom_tolerance(bucket),
+    )
+    for (feature, cached), coordinates in zip(pending, simplified):
+        cached['zooms'][bucket] = coordinates.tolist()
+        feature['geometry']['coordinates'] = cached['zooms'][bucket]
+
+
+def _intersecting(
+    features: List[dict], area: shapely.Geometry, keep_ids: Iterable[str] = ()
+) -> List[dict]:
+    """Features intersecting area in the plane, and those in keep_ids."""
+    if not features:
+        return features
+    keep_ids = set(keep_ids)
+    hits = shapely.intersects(
+        [shape(feature['geometry']) for feature in features], area
+    )
+    return [
+        feature for feature, hit in zip(features, hits)
+        if hit or feature['_id'] in keep_ids
+    ]
+
+
+async def query_segments(
+    bbox: List[Tuple[float, float]],
+    exclude_ids: List[str] = [],
+    include_if_modified_after: Optional[datetime] = None,
+    details: bool = False,
+    zoom: Optional[float] = None,
+    within: Optional[Bounds] = None,
+) -> dict:
+    """
+    Segments intersecting bbox, summarized unless details are requested.
+
+    With within, only features intersecting those bounds in the plane are
+    kept, before simplification. Cached tile ranges use it so that what
+    they hold matches the tiles writes invalidate.
+    """
+    if segment_replica.ready and not details:
+        features = segment_replica.query(bbox, exclude_ids, include_if_modified_after)
+    else:
+        # Answer in the plane like the replica and the tiles, Mongo takes the
+        # bbox edges for great circles, so it gets a ring covering the bbox
+        area = Polygon(bbox)
+        query = _segment_filter(
+            geodesic_cover(area), exclude_ids, include_if_modified_after
+        )
+        pipeline = [{'$match': query}, _summary_stage(details)]
+        features = _intersecting(
+            [feature async for feature in segment_collection.aggregate(pipeline)],
+            area,
+            # Changed held segments are sent wherever they are
+            keep_ids=exclude_ids if include_if_modified_after else (),
+        )
+    if within is not None:
+        features = _intersecting(features, shapely.box(*within))
+    if zoom is not None:
+        _simplify_features(features, zoom)
     return {
         'type': 'FeatureCollection',
-        'features': features
+        'features': features,
+        'deleted_ids': await get_deleted_segment_ids(
+            exclude_ids, include_if_modified_after
+        ),
     }
 
 
+async def _segments_written(changes: List[Tuple[Optional[dict], Optional[dict]]]):
+    """Update everything derived from segments after (old, new) writes."""
+    for old, new in changes:
+        simplified_geometry_cache.pop((old or new)['_id'])
+        live_feed.remember(old)
+    segment_replica.apply(changes)
+    await response_cache.invalidate_geometries(
+        segment['geometry'] for change in changes for segment in change if segment
+    )
+    await update_cluster_stats(changes)
+    await bump_counter('segments')
+
+
 async def get_segment(segment_id: str):
     segment = await segment_collection.find_one({'_id' : segment_id})
+    if segment is None:
+        return None
     segment['id'] = segment['_id']
     segment['properties']['has_subsegments'] = len(
             segment['properties']['subsegments']
@@ -46,50 +214,646 @@ async def get_segment(segment_id: str):
     return segment
 
 
-async def get_segments() -> dict:
-    features = []
-    async for feature in segment_collection.find():
-        features.append(feature)
+_sort_fields = {
+    schemas.SegmentOrder.id: '_id',
+    schemas.SegmentOrder.modified_at: 'properties.modified_at',
+}
+
+
+def _encode_cursor(order_by: schemas.SegmentOrder, feature: dict) -> str:
+    value = feature['_id']
+    if order_by == schemas.SegmentOrder.modified_at:
+        # Legacy segments have no modified_at, they sort first as null
+        modified_at = feature['properties'].get('modified_at')
+        value = modified_at.isoformat() if modified_at else None
+    token = orjson.dumps({'order_by': order_by, 'value': value, 'id': feature['_id']})
+    return base64.urlsafe_b64encode(token).decode()
+
+
+def _cursor_filter(order_by: schemas.SegmentOrder, cursor: str) -> dict:
+    try:
+        token = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if token['order_by'] != order_by:
+            raise ValueError(token['order_by'])
+        if order_by == schemas.SegmentOrder.id:
+            return {'_id': {'$gt': token['id']}}
+        modified_at = token['value']
+        if modified_at is not None:
+            modified_at = datetime.fromisoformat(modified_at)
+    except (binascii.Error, KeyError, TypeError, ValueError):
+        raise HTTPException(400, validation["cursor"])
+    if modified_at is None:
+        return {'$or': [
+            {'properties.modified_at': {'$ne': None}},
+            {'properties.modified_at': None, '_id': {'$gt': token['id']}},
+        ]}
+    # modified_at is not unique, ties are broken by _id
+    return {'$or': [
+        {'properties.modified_at': {'$gt': modified_at}},
+        {'properties.modified_at': modified_at, '_id': {'$gt': token['id']}},
+    ]}
+
+
+async def get_segments(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    order_by: schemas.SegmentOrder = schemas.SegmentOrder.id,
+) -> dict:
+    """
+    List segments in a stable order, one page at a time when a limit is given.
+
+    Pages are fetched with a range query on the sort key from an opaque
+    continuation token, rather than with skip, so every page costs the same
+    however deep into the collection it is.
+    """
+    query = _cursor_filter(order_by, cursor) if cursor else {}
+    sort = [(_sort_fields[order_by], 1)]
+    if order_by != schemas.SegmentOrder.id:
+        sort.append(('_id', 1))
+    features = [
+        feature async for feature in
+        segment_collection.find(query).sort(sort).limit(limit or 0)
+    ]
+    next_cursor = None
+    if limit and len(features) == limit:
+        next_cursor = _encode_cursor(order_by, features[-1])
     return {
         'type': 'FeatureCollection',
-        'features': features
+        'features': features,
+        'next_cursor': next_cursor,
     }
 
 
+async def stream_segments(
+    format: schemas.ExportFormat = schemas.ExportFormat.geojson,
+    batch_size: int = settings.stream_batch_size,
+) -> AsyncIterator[bytes]:
+    """
+    Serialize the segments collection chunk by chunk straight from the cursor.
+
+    Only one batch of features is held in memory at a time, as either a
+    GeoJSON FeatureCollection, newline delimited features or a GeoJSON text
+    sequence (RFC 8142).
+    """
+    collection = format == schemas.ExportFormat.geojson
+    prefix = b'\x1e' if format == schemas.ExportFormat.geojsonseq else b''
+    suffix = b'' if collection else b'\n'
+    separator = b',' if collection else b''
+
+    if collection:
+        yield b'{"type":"FeatureCollection","features":['
+    first = True
+    batch = []
+    async for feature in segment_collection.find().batch_size(batch_size):
+        batch.append(prefix + orjson.dumps(feature) + suffix)
+        if len(batch) == batch_size:
+            yield (b'' if first else separator) + separator.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield (b'' if first else separator) + separator.join(batch)
+    if collection:
+        yield b']}'
+
+
 async def create_segment(
     segment: dict, user_id: str
 ) -> dict:
     segment['_id'] = str(uuid4())
-    segment['properties']['created_at'] = datetime.now()
-    segment['properties']['modified_at'] = datetime.now()
+    now = datetime.now()
+    segment['properties']['created_at'] = now
+    segment['properties']['modified_at'] = now
     segment['properties']['owner_id'] = user_id
+    segment['properties']['version'] = 1
+    segment['properties']['cluster_id'] = await find_cluster_id(segment['geometry'])
+    derive_fields([segment])
 
     result = await segment_collection.insert_one(segment)
 
     if result.acknowledged is True:
+        await _segments_written([(None, segment)])
         segment['id'] = segment['_id']
         return segment
 
 
+def _owner_filter(user: dict) -> dict:
+    if user['permission_level'] < access_levels['contributor']:
+        return {'properties.owner_id': user['id']}
+    return {}
+
+
+def _version_filter(expected_version: Optional[int]) -> dict:
+    if expected_version is None:
+        return {}
+    if expected_version == 0:
+        # Segments written before versioning have no version field
+        return {'properties.version': {'$in': [0, None]}}
+    return {'properties.version': expected_version}
+
+
+async def _raise_write_failure(
+    segment_id: str, user: dict, order_numbers: Iterable[int] = ()
+):
+    """Explain why a filtered write matched nothing: 404, 403 or 412."""
+    segment = await segment_collection.find_one(
+        {'_id': segment_id},
+        {'properties.owner_id': 1, 'properties.subsegments.order_number': 1},
+    )
+    if segment is None:
+        raise HTTPException(404, validation["segment_not_found"])
+    user_can_operate(user, segment['properties']['owner_id'])
+    existing = {
+        subsegment.get('order_number')
+        for subsegment in segment['properties'].get('subsegments', [])
+    }
+    if not set(order_numbers) <= existing:
+        raise HTTPException(404, validation["subsegment_not_found"])
+    raise HTTPException(412, validation["version_conflict"])
+
+
 async def update_segment(
-    segment_id: str, segment: dict, user: schemas.User
+    segment_id: str,
+    segment: dict,
+    user: schemas.User,
+    expected_version: Optional[int] = None,
 ) -> dict:
-    db_segment = await segment_collection.find_one({'_id': segment_id})
-    user_can_operate(user, db_segment['properties']['owner_id'])
+    """
+    Replace a segment in a single find_one_and_update.
 
-    segment['properties']['owner_id'] = user['id']
-    await segment_collection.replace_one(
-        {'_id': segment_id},
-        segment
+    Ownership and, if given, the expected version are part of the filter,
+    so concurrent edits fail with a 412 instead of overwriting each other.
+    """
+    derive_fields([segment])
+    properties = dict(segment['properties'])
+    properties.pop('created_at', None)
+    properties.pop('version', None)
+    properties['owner_id'] = user['id']
+    properties['modified_at'] = datetime.now()
+    properties['cluster_id'] = await find_cluster_id(segment['geometry'])
+
+    db_segment = await segment_collection.find_one_and_update(
+        {
+            '_id': segment_id,
+            **_owner_filter(user),
+            **_version_filter(expected_version),
+        },
+        [{'$set': {
+            'type': {'$literal': segment.get('type', 'Feature')},
+            'geometry': {'$literal': segment['geometry']},
+            'bbox': {'$literal': segment['bbox']},
+            'properties': {'$mergeObjects': [
+                {'created_at': '$properties.created_at'},
+                {'$literal': properties},
+                {'version': {'$add': [{'$ifNull': ['$properties.version', 0]}, 1]}},
+            ]},
+        }}],
+        return_document=ReturnDocument.BEFORE,
+    )
+    if db_segment is None:
+        await _raise_write_failure(segment_id, user)
+
+    updated_segment = {
+        **db_segment,
+        'type': segment.get('type', 'Feature'),
+        'geometry': segment['geometry'],
+        'bbox': segment['bbox'],
+        'properties': {
+            'created_at': db_segment['properties'].get('created_at'),
+            **properties,
+            'version': (db_segment['properties'].get('version') or 0) + 1,
+        },
+    }
+    await _segments_written([(db_segment, updated_segment)])
+    updated_segment['id'] = updated_segment['_id']
+    return updated_segment
+
+
+# Set by the server, never by a patch
+_protected_properties = {
+    'owner_id',
+    'created_at',
+    'modified_at',
+    'version',
+    'cluster_id',
+    'has_subsegments',
+    'length_in_meters',
+}
+
+
+def _validate(type_: Any, value: Any) -> Any:
+    try:
+        return jsonable_encoder(parse_obj_as(type_, value))
+    except ValidationError as e:
+        raise HTTPException(422, e.errors())
+
+
+def _validate_field(model: BaseModel, name: str, value: Any) -> Any:
+    field = model.__fields__.get(name)
+    if field is None:
+        raise HTTPException(422, validation["patch_path"])
+    value, errors = field.validate(value, {}, loc=name)
+    if errors:
+        raise HTTPException(422, ValidationError([errors], model).errors())
+    return jsonable_encoder(value)
+
+
+def _patch_update(
+    operations: List[schemas.PatchOperation],
+) -> Tuple[dict, list, List[int]]:
+    """
+    Translate patch operations into one Mongo update and its array filters.
+
+    Subsegments are addressed by order_number rather than by list index:
+    /properties/subsegments/- appends, /properties/subsegments/<order_number>
+    and /properties/subsegments/<order_number>/<field> change or remove
+    the subsegment with that order number, which has to be unique.
+    """
+    set_ = {}
+    unset = {}
+    push = []
+    pull = []
+    array_filters = []
+    remove = schemas.PatchOp.remove
+
+    def subsegment_path(order_number: int) -> str:
+        identifier = f'subsegment{len(array_filters)}'
+        array_filters.append({f'{identifier}.order_number': order_number})
+        return f'properties.subsegments.$[{identifier}]'
+
+    for operation in operations:
+        path = operation.path.strip('/').split('/')
+        if path == ['geometry'] and operation.op != remove:
+            set_['geometry'] = _validate(Geometry, operation.value)
+        elif path[0] != 'properties' or len(path) < 2:
+            raise HTTPException(422, validation["patch_path"])
+        elif path[1] != 'subsegments':
+            if len(path) != 2 or path[1] in _protected_properties:
+                raise HTTPException(422, validation["patch_path"])
+            if operation.op == remove:
+                unset[f'properties.{path[1]}'] = ''
+            else:
+                set_[f'properties.{path[1]}'] = _validate_field(
+                    schemas.segment.Properties, path[1], operation.value
+                )
+        elif len(path) == 2 and operation.op != remove:
+            set_['properties.subsegments'] = _validate(
+                List[schemas.segment.SubsegmentBase], operation.value
+            )
+        elif path[2:] == ['-'] and operation.op == schemas.PatchOp.add:
+            push.append(_validate(schemas.segment.SubsegmentBase, operation.value))
+        else:
+            try:
+                order_number = int(path[2])
+            except (IndexError, ValueError):
+                raise HTTPException(422, validation["patch_path"])
+            if len(path) == 3 and operation.op == remove:
+                pull.append(order_number)
+            elif len(path) == 3:
+                set_[subsegment_path(order_number)] = _validate(
+                    schemas.segment.SubsegmentBase, operation.value
+                )
+            elif len(path) == 4 and operation.op != remove:
+                set_[f'{subsegment_path(order_number)}.{path[3]}'] = _validate_field(
+                    schemas.segment.SubsegmentBase, path[3], operation.value
+                )
+            else:
+                raise HTTPException(422, validation["patch_path"])
+
+    set_['properties.modified_at'] = datetime.now()
+    update = {'$set': set_, '$inc': {'properties.version': 1}}
+    if unset:
+        update['$unset'] = unset
+    if push:
+        update['$push'] = {'properties.subsegments': {'$each': push}}
+    if pull:
+        update['$pull'] = {'properties.subsegments': {'order_number': {'$in': pull}}}
+    order_numbers = pull + [
+        next(iter(array_filter.values())) for array_filter in array_filters
+    ]
+    return update, array_filters, order_numbers
+
+
+SUBSEGMENT_FILTER_PATH = 'properties.subsegments.$['
+
+
+def _with_derived_fields(
+    segment: dict, update: dict, array_filters: list
+) -> Tuple[dict, list]:
+    """
+    The update and array filters, storing the fields derived from what it changes.
+
+    Derived values are computed from segment, the before image the update is
+    pinned to. Changed subsegments are set whole, with their estimates.
+    """
+    set_ = {}
+    filtered = {}
+    for path, value in update['$set'].items():
+        if path.startswith(SUBSEGMENT_FILTER_PATH):
+            filtered[path] = value
+        else:
+            set_[path] = value
+    update = {**update, '$set': set_}
+    if 'geometry' in set_:
+        (derived,) = derive_fields([{'geometry': set_['geometry'], 'properties': {}}])
+        set_['bbox'] = derived['bbox']
+        set_['properties.length_in_meters'] = derived['properties']['length_in_meters']
+    if 'properties.subsegments' in set_:
+        set_['properties.subsegments'] = derive_subsegment_fields(
+            [dict(subsegment) for subsegment in set_['properties.subsegments']]
+        )
+    if '$push' in update:
+        update['$push'] = {'properties.subsegments': {
+            '$each': derive_subsegment_fields([
+                dict(subsegment)
+                for subsegment in update['$push']['properties.subsegments']['$each']
+            ])
+        }}
+
+    # Array filters match the subsegments as they were before the update
+    order_numbers = {
+        identifier.split('.')[0]: order_number
+        for array_filter in array_filters
+        for identifier, order_number in array_filter.items()
+    }
+    stored = {
+        subsegment.get('order_number'): subsegment
+        for subsegment in segment['properties'].get('subsegments') or []
+    }
+    changed = {}
+    for path, value in filtered.items():
+        identifier, _, field = path[len(SUBSEGMENT_FILTER_PATH):].partition(']')
+        order_number = order_numbers[identifier]
+        if order_number not in changed:
+            changed[order_number] = dict(stored[order_number])
+        if field:
+            changed[order_number][field.lstrip('.')] = value
+        else:
+            changed[order_number] = dict(value)
+    derive_subsegment_fields(list(changed.values()))
+
+    filters = []
+    for order_number, subsegment in changed.items():
+        identifier = f'subsegment{len(filters)}'
+        filters.append({f'{identifier}.order_number': order_number})
+        set_[f'properties.subsegments.$[{identifier}]'] = subsegment
+    return update, filters
+
+
+def _raise_ambiguous(segment: dict, order_numbers: Iterable[int]):
+    counts = Counter(
+        subsegment.get('order_number')
+        for subsegment in segment['properties'].get('subsegments') or []
     )
-    updated_segment = await segment_collection.find_one({'_id': segment_id})
+    if any(counts[order_number] > 1 for order_number in order_numbers):
+        raise HTTPException(409, validation["subsegment_ambiguous"])
+
+
+async def _find_one_and_patch(
+    query: dict,
+    update: dict,
+    array_filters: list,
+    order_numbers: List[int],
+    attempts: int = 3,
+) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Apply update to the segment matching query, returning (before, after).
+
+    The before image is read first and the update is pinned to its
+    version, which every write increments, so both images belong to the
+    same atomic write. The derived fields computed from the before image
+    go in the same write. Another write in between is retried.
+    """
+    for _ in range(attempts):
+        db_segment = await segment_collection.find_one(query)
+        if db_segment is None:
+            return None, None
+        _raise_ambiguous(db_segment, order_numbers)
+        version = db_segment['properties'].get('version')
+        write, write_filters = _with_derived_fields(db_segment, update, array_filters)
+        try:
+            updated_segment = await segment_collection.find_one_and_update(
+                {**query, 'properties.version': version},
+                write,
+                array_filters=write_filters or None,
+                return_document=ReturnDocument.AFTER,
+            )
+        except OperationFailure as e:
+            # Eg. pushing to and pulling from the subsegments in one patch
+            if e.code == 40:
+                raise HTTPException(400, validation["patch_conflict"])
+            raise
+        if updated_segment is not None:
+            return db_segment, updated_segment
+    raise HTTPException(412, validation["version_conflict"])
+
+
+async def patch_segment(
+    segment_id: str,
+    operations: List[schemas.PatchOperation],
+    user: dict,
+    expected_version: Optional[int] = None,
+) -> dict:
+    """Apply JSON-Patch style operations with targeted update operators."""
+    if not operations:
+        raise HTTPException(422, validation["patch_path"])
+    update, array_filters, order_numbers = _patch_update(operations)
+    if 'geometry' in update['$set']:
+        update['$set']['properties.cluster_id'] = await find_cluster_id(
+            update['$set']['geometry']
+        )
+
+    query = {
+        '_id': segment_id,
+        **_owner_filter(user),
+        **_version_filter(expected_version),
+    }
+    if order_numbers:
+        query['$and'] = [
+            {'properties.subsegments.order_number': order_number}
+            for order_number in set(order_numbers)
+        ]
+    db_segment, updated_segment = await _find_one_and_patch(
+        query, update, array_filters, order_numbers
+    )
+    if db_segment is None:
+        await _raise_write_failure(segment_id, user, order_numbers)
+
+    await _segments_written([(db_segment, updated_segment)])
     updated_segment['id'] = updated_segment['_id']
     return updated_segment
 
 
+async def patch_subsegment(
+    segment_id: str,
+    order_number: int,
+    changes: dict,
+    user: dict,
+    expected_version: Optional[int] = None,
+) -> dict:
+    return await patch_segment(
+        segment_id,
+        [
+            schemas.PatchOperation(
+                op=schemas.PatchOp.replace,
+                path=f'/properties/subsegments/{order_number}/{name}',
+                value=value,
+            )
+            for name, value in changes.items()
+        ],
+        user,
+        expected_version,
+    )
+
+
 async def delete_segment(segment_id: str, user: schemas.User):
-    segment = await segment_collection.find_one({'_id': segment_id})
-    # Send a 403 and bail out if the user does not have appropriate permissions
-    user_can_operate(user, segment['properties']['owner_id'])
-    await segment_collection.delete_one({'_id': segment_id})
+    segment = await segment_collection.find_one_and_delete(
+        {'_id': segment_id, **_owner_filter(user)}
+    )
+    if segment is None:
+        await _raise_write_failure(segment_id, user)
+    # Keep a tombstone so clients syncing incrementally can evict the segment,
+    # its geometry tells live feed subscribers whether the delete concerns them.
+    # It goes in before the counter bump, a client revalidating in between
+    # would otherwise get the new ETag without the tombstone.
+    await deleted_segment_collection.replace_one(
+        {'_id': segment_id},
+        {
+            '_id': segment_id,
+            'deleted_at': datetime.now(),
+            'geometry': segment['geometry'],
+        },
+        upsert=True,
+    )
+    await _segments_written([(segment, None)])
     return True
+
+
+async def _upsert_chunk(chunk: List[Tuple[int, Any]], user: dict) -> List[dict]:
+    results = []
+    valid = []
+    ids = set()
+    for index, feature in chunk:
+        try:
+            schemas.SegmentCreate.parse_obj(feature)
+        except ValidationError as e:
+            results.append({'index': index, 'status': 'error', 'detail': e.errors()})
+            continue
+        feature['_id'] = str(feature.pop('id', None) or feature.get('_id') or uuid4())
+        # Each write is diffed against the same snapshot, only take the first
+        if feature['_id'] in ids:
+            results.append({
+                'index': index,
+                'id': feature['_id'],
+                'status': 'error',
+                'detail': validation["bulk_duplicate_id"],
+            })
+            continue
+        ids.add(feature['_id'])
+        valid.append((index, feature))
+
+    existing = {
+        segment['_id']: segment async for segment in segment_collection.find(
+            {'_id': {'$in': [feature['_id'] for _, feature in valid]}}
+        )
+    }
+    cluster_ids = await asyncio.gather(
+        *(find_cluster_id(feature['geometry']) for _, feature in valid)
+    )
+
+    now = datetime.now()
+    operations = []
+    written = []
+    for (index, feature), cluster_id in zip(valid, cluster_ids):
+        old = existing.get(feature['_id'])
+        if old is not None:
+            try:
+                user_can_operate(user, old['properties']['owner_id'])
+            except HTTPException as e:
+                results.append({
+                    'index': index,
+                    'id': feature['_id'],
+                    'status': 'error',
+                    'detail': e.detail,
+                })
+                continue
+        properties = feature['properties']
+        properties['created_at'] = old['properties'].get('created_at') if old else now
+        properties['modified_at'] = now
+        properties['owner_id'] = user['id']
+        properties['cluster_id'] = cluster_id
+        properties['version'] = 1
+        query = {'_id': feature['_id'], **_owner_filter(user)}
+        if old is not None:
+            version = old['properties'].get('version') or 0
+            properties['version'] += version
+            query.update(_version_filter(version))
+        derive_fields([feature])
+
+        # Fails with a duplicate key if someone else created or changed it
+        # since the snapshot, the upsert then collides with their document
+        operations.append(ReplaceOne(query, feature, upsert=True))
+        written.append((index, old, feature))
+
+    failed = {}
+    if operations:
+        try:
+            await segment_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            failed = {
+                error['index']: validation["version_conflict"]
+                if error['code'] == DUPLICATE_KEY else error['errmsg']
+                for error in e.details['writeErrors']
+            }
+
+    changes = []
+    for operation_index, (index, old, new) in enumerate(written):
+        result = {'index': index, 'id': new['_id']}
+        if operation_index in failed:
+            result.update(status='error', detail=failed[operation_index])
+        else:
+            result['status'] = 'updated' if old else 'created'
+            changes.append((old, new))
+        results.append(result)
+
+    if changes:
+        await deleted_segment_collection.delete_many(
+            {'_id': {'$in': [new['_id'] for _, new in changes]}}
+        )
+        await _segments_written(changes)
+    return results
+
+
+async def bulk_upsert_segments(
+    features: AsyncIterator[Any],
+    user: dict,
+    chunk_size: int = settings.bulk_chunk_size,
+) -> dict:
+    """
+    Validate and upsert features in chunks of unordered bulk writes.
+
+    Features with an id replace the existing segment if the user may
+    operate on it, all others are created. A segment changed by someone
+    else while its chunk is written is left alone and reported as a
+    version conflict. Every feature gets a result with its position in
+    the input.
+    """
+    results = []
+    chunk = []
+    index = 0
+    async for feature in features:
+        chunk.append((index, feature))
+        index += 1
+        if len(chunk) == chunk_size:
+            results.extend(await _upsert_chunk(chunk, user))
+            chunk = []
+    if chunk:
+        results.extend(await _upsert_chunk(chunk, user))
+
+    results.sort(key=lambda result: result['index'])
+    statuses = [result['status'] for result in results]
+    return {
+        'created': statuses.count('created'),
+        'updated': statuses.count('updated'),
+        'errors': statuses.count('error'),
+        'results': results,
+    }
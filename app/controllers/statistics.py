@@ -0,0 +1,82 @@
+from typing import Any, List
+
+from .segments import segment_collection
+
+# Grouped among subsegments where parking is allowed
+_allowed_dimensions = ['street_location', 'alignment', 'fee', 'user_restriction_reason']
+
+
+def _sum_stats() -> dict:
+    return {
+        'car_count': {'$sum': {'$ifNull': [
+            '$subsegment.car_count',
+            {'$ifNull': ['$subsegment.estimated_car_count', 0]},
+        ]}},
+        'length_in_meters': {'$sum': {'$ifNull': ['$subsegment.length_in_meters', 0]}},
+        'subsegment_count': {'$sum': 1},
+    }
+
+
+def _subsegments(*stages: dict) -> List[dict]:
+    return [{'$unwind': '$subsegment'}, *stages]
+
+
+def _key(value: Any) -> str:
+    if value is None:
+        return 'unknown'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _group_by(field: str, parking_allowed: bool) -> List[dict]:
+    return _subsegments(
+        {'$match': {'subsegment.parking_allowed': parking_allowed}},
+        {'$group': {'_id': f'$subsegment.{field}', **_sum_stats()}},
+    )
+
+
+async def get_statistics(geometry: dict) -> dict:
+    """
+    Parking capacity of the segments intersecting geometry.
+
+    Everything is aggregated inside Mongo in one $facet pass, only the
+    grouped totals reach Python.
+    """
+    facets = {
+        'segments': [{'$count': 'count'}],
+        'parking_allowed': _subsegments(
+            {'$group': {
+                '_id': {'$ifNull': ['$subsegment.parking_allowed', False]},
+                **_sum_stats(),
+            }},
+        ),
+        'no_parking_reasons': _subsegments(
+            {'$match': {'subsegment.parking_allowed': False}},
+            {'$unwind': '$subsegment.no_parking_reasons'},
+            {'$group': {'_id': '$subsegment.no_parking_reasons', **_sum_stats()}},
+        ),
+    }
+    for field in _allowed_dimensions:
+        facets[field] = _group_by(field, parking_allowed=True)
+
+    pipeline = [
+        {'$match': {'geometry': {'$geoIntersects': {'$geometry': geometry}}}},
+        {'$project': {
+            '_id': 0,
+            'subsegment': {'$ifNull': ['$properties.subsegments', []]},
+        }},
+        {'$facet': facets},
+    ]
+    result = await segment_collection.aggregate(pipeline).next()
+
+    statistics = {
+        'segment_count': result['segments'][0]['count'] if result['segments'] else 0,
+        'parking_allowed': {
+            'allowed' if group['_id'] else 'not_allowed': group
+            for group in result.pop('parking_allowed')
+        },
+    }
+    for field in _allowed_dimensions + ['no_parking_reasons']:
+        statistics[field] = {_key(group['_id']): group for group in result[field]}
+    return statistics
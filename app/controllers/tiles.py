@@ -0,0 +1,14 @@
+from starlette.concurrency import run_in_threadpool
+
+from ..config import settings
+from ..geo import bounds_polygon, buffered_tile_bounds, encode_tile
+from .segments import query_segments
+
+
+async def get_segment_tile(z: int, x: int, y: int) -> bytes:
+    # Also fetch segments in the tile buffer so lines are not cut at the edge
+    bounds = buffered_tile_bounds(
+        z, x, y, settings.tile_buffer / settings.tile_extent
+    )
+    result = await query_segments(bbox=bounds_polygon(bounds), zoom=z)
+    return await run_in_threadpool(encode_tile, result['features'], z, x, y)
@@ -1,14 +1,23 @@
 from uuid import uuid4
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from ..services import db
+from ..config import settings
+from ..services import db, LRUCache, RevocationList, SessionSigner
 
 user_collection = db['users']
 session_collection = db['sessions']
+# session id -> user, so authenticated requests skip the database
+session_cache = LRUCache(settings.session_cache_size, ttl=settings.session_cache_ttl)
+session_signer = SessionSigner()
+revocation_list = RevocationList(db['revoked_sessions'])
+
+
+def _signed_sessions() -> bool:
+    return settings.session_backend == "signed"
 
 
 async def get_user(user_id: str) -> dict:
-    user = await db.user_collection.find_one({'_id': user_id})
+    user = await user_collection.find_one({'_id': user_id})
     user['id'] = user['_id']
     return user
 
@@ -34,24 +43,105 @@ async def create_user(email: str) -> dict:
         return user
 
 
-async def create_session(user_id: str) -> str:
+async def create_session(user: dict) -> str:
+    if _signed_sessions():
+        return session_signer.issue(user)
     session = {}
     session['_id'] = str(uuid4())
-    session['owner_id'] = user_id
+    session['owner_id'] = user['id']
+    session['created_at'] = datetime.now()
     result = await session_collection.insert_one(session)
     if result.acknowledged is True:
         return session['_id']
 
 
-async def get_logged_in_user(session_id: str) -> dict:
-    session = await session_collection.find_one({'_id': session_id})
-    if session is None:
+async def _get_signed_session_user(token: str) -> dict:
+    claims = session_signer.verify(token)
+    if claims is None:
         return None
-    user = await user_collection.find_one({'_id': session['owner_id']})
-    print(user)
-    return user
+    await revocation_list.refresh()
+    if revocation_list.is_revoked(claims):
+        return None
+    return {
+        '_id': claims['sub'],
+        'email': claims['email'],
+        'permission_level': claims['permission_level'],
+    }
+
+
+async def get_logged_in_user(session_id: str) -> dict:
+    if _signed_sessions():
+        return await _get_signed_session_user(session_id)
+
+    user = session_cache.get(session_id)
+    if user is not None:
+        return dict(user)
+
+    expired_before = datetime.now() - timedelta(seconds=settings.session_expiry)
+    async for session in session_collection.aggregate([
+        {'$match': {'_id': session_id, 'created_at': {'$gt': expired_before}}},
+        {'$lookup': {
+            'from': 'users',
+            'localField': 'owner_id',
+            'foreignField': '_id',
+            'as': 'user',
+        }},
+        {'$unwind': '$user'},
+    ]):
+        # Never cache a session beyond its expiry
+        expires_in = (session['created_at'] - expired_before).total_seconds()
+        session_cache.set(
+            session_id, session['user'], min(expires_in, settings.session_cache_ttl)
+        )
+        return dict(session['user'])
+    return None
+
+
+async def delete_undated_sessions() -> int:
+    """
+    Delete sessions stored before they had a created_at.
+
+    They are never accepted as logged in, and the TTL index only expires
+    documents that have the field.
+    """
+    result = await session_collection.delete_many({'created_at': {'$exists': False}})
+    return result.deleted_count
 
 
 async def clear_session(session_id: str):
+    if _signed_sessions():
+        claims = session_signer.verify(session_id)
+        if claims is not None:
+            await revocation_list.revoke_token(
+                claims, datetime.utcfromtimestamp(claims['exp'])
+            )
+        return claims and claims['jti']
+
+    session_cache.pop(session_id)
     await session_collection.delete_one({'_id': session_id})
     return session_id
+
+
+async def update_user_permission(user_id: str, permission_level: int) -> dict:
+    """
+    Change the permission level of a user and drop their sessions' copies.
+
+    Other processes only see the change once their session_cache entries
+    expire, after at most session_cache_ttl seconds. Revoked signed tokens
+    are picked up within revocation_refresh_seconds.
+    """
+    await user_collection.update_one(
+        {'_id': user_id},
+        {'$set': {
+            'permission_level': permission_level,
+            'modified_at': datetime.now(),
+        }},
+    )
+    session_cache.pop_matching(lambda user: user['_id'] == user_id)
+    if _signed_sessions():
+        # Signed tokens carry the old permission level, the user logs in again
+        await revocation_list.revoke_user(
+            user_id,
+            datetime.utcnow() + timedelta(seconds=settings.session_expiry),
+        )
+    return await get_user(user_id)
@@ -0,0 +1,21 @@
+from .simplify import simplify_lines, zoom_tolerance  # noqa
+from .tiles import (  # noqa
+    Bounds,
+    TileRange,
+    bbox_tiles,
+    bounds_polygon,
+    buffered_tile_bounds,
+    first_coordinate,
+    geodesic_cover,
+    geometry_tiles,
+    lonlat_to_mercator,
+    lonlat_to_tile,
+    ring_bounds,
+    snap_bbox,
+    tile_bounds,
+    tile_mercator_bounds,
+    valid_tile,
+)
+from .mvt import encode_tile  # noqa
+from .index import SpatialIndex  # noqa
+from .measure import geometry_lengths, line_lengths  # noqa
@@ -0,0 +1,121 @@
+from typing import Any, Hashable, Iterable, List, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+
+class SpatialIndex:
+    """
+    Items keyed by id, found by intersecting their geometry with an area.
+
+    The bulk of the entries sits in a packed STR tree. Entries added since
+    it was built are kept in arrays of bounds and scanned with NumPy, until
+    `rebuild_threshold` additions or removals accumulate and the tree is
+    rebuilt. Candidates are refined with an exact, planar intersection test.
+    """
+
+    def __init__(self, rebuild_threshold: int = 1000):
+        self.rebuild_threshold = rebuild_threshold
+        self.build([])
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def build(self, entries: Iterable[Tuple[Hashable, dict, Any]]):
+        """Replace all entries with (id, GeoJSON geometry, item) tuples."""
+        entries = list(entries)
+        self.slots = {}
+        self.ids: List[Hashable] = []
+        self.items: List[Any] = []
+        self.size = 0
+        self.geometries = np.empty(0, dtype=object)
+        self.bounds = np.empty((0, 4))
+        self.live = np.empty(0, dtype=bool)
+        self._reserve(len(entries))
+        for id_, geometry, item in entries:
+            self._append(id_, shape(geometry), item)
+        self._build_tree()
+
+    def add(self, id_: Hashable, geometry: dict, item: Any):
+        self.remove(id_)
+        self._reserve(self.size + 1)
+        self._append(id_, shape(geometry), item)
+        self._maintain()
+
+    def get(self, id_: Hashable, default: Any = None) -> Any:
+        slot = self.slots.get(id_)
+        return default if slot is None else self.items[slot]
+
+    def remove(self, id_: Hashable):
+        slot = self.slots.pop(id_, None)
+        if slot is None:
+            return
+        self.live[slot] = False
+        self.items[slot] = None
+        self.dead += 1
+        self._maintain()
+
+    def query(self, area: shapely.Geometry) -> List[Any]:
+        hits = []
+        if self.tree_size:
+            tree_hits = self.tree.query(area, predicate='intersects')
+            hits.append(tree_hits[self.live[tree_hits]])
+
+        recent = np.arange(self.tree_size, self.size)
+        if len(recent):
+            west, south, east, north = area.bounds
+            bounds = self.bounds[recent]
+            recent = recent[
+                self.live[recent]
+                & (bounds[:, 0] <= east) & (bounds[:, 2] >= west)
+                & (bounds[:, 1] <= north) & (bounds[:, 3] >= south)
+            ]
+            hits.append(recent[shapely.intersects(self.geometries[recent], area)])
+
+        return [self.items[slot] for part in hits for slot in part]
+
+    def _reserve(self, capacity: int):
+        if capacity <= len(self.live):
+            return
+        capacity = max(capacity, 2 * len(self.live), 1024)
+        geometries = np.empty(capacity, dtype=object)
+        geometries[:self.size] = self.geometries[:self.size]
+        bounds = np.empty((capacity, 4))
+        bounds[:self.size] = self.bounds[:self.size]
+        live = np.zeros(capacity, dtype=bool)
+        live[:self.size] = self.live[:self.size]
+        self.geometries, self.bounds, self.live = geometries, bounds, live
+
+    def _append(self, id_: Hashable, geometry: shapely.Geometry, item: Any):
+        slot = self.size
+        self.geometries[slot] = geometry
+        self.bounds[slot] = geometry.bounds
+        self.live[slot] = True
+        self.ids.append(id_)
+        self.items.append(item)
+        self.slots[id_] = slot
+        self.size += 1
+
+    def _maintain(self):
+        if self.size - self.tree_size + self.dead > self.rebuild_threshold:
+            self._compact()
+            self._build_tree()
+
+    def _compact(self):
+        live = np.flatnonzero(self.live[:self.size])
+        count = len(live)
+        self.geometries[:count] = self.geometries[live]
+        self.geometries[count:self.size] = None
+        self.bounds[:count] = self.bounds[live]
+        self.live[:count] = True
+        self.live[count:self.size] = False
+        self.ids = [self.ids[slot] for slot in live]
+        self.items = [self.items[slot] for slot in live]
+        self.slots = {id_: slot for slot, id_ in enumerate(self.ids)}
+        self.size = count
+
+    def _build_tree(self):
+        self.tree = shapely.STRtree(self.geometries[:self.size])
+        self.tree_size = self.size
+        self.dead = 0
@@ -0,0 +1,61 @@
+from typing import List, Optional
+
+import numpy as np
+
+# Mean earth radius, as used for haversine distances
+EARTH_MEAN_RADIUS = 6371008.8
+
+
+def line_lengths(lines: List[np.ndarray]) -> np.ndarray:
+    """
+    Geodesic lengths in meters of many lon/lat lines at once.
+
+    All coordinates are concatenated into one array, so the haversine
+    formula runs once over every pair of consecutive points.
+    """
+    lines = [np.asarray(line, dtype=float).reshape(-1, 2) for line in lines]
+    sizes = np.array([len(line) for line in lines], dtype=int)
+    if sizes.sum() < 2:
+        return np.zeros(len(lines))
+
+    points = np.radians(np.concatenate(lines))
+    line_of_point = np.repeat(np.arange(len(lines)), sizes)
+    # Pairs of consecutive points belonging to the same line
+    same_line = line_of_point[1:] == line_of_point[:-1]
+    lon, lat = points[:, 0], points[:, 1]
+    d_lon = lon[1:] - lon[:-1]
+    d_lat = lat[1:] - lat[:-1]
+    a = (
+        np.sin(d_lat / 2) ** 2
+        + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(d_lon / 2) ** 2
+    )
+    distances = 2 * EARTH_MEAN_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return np.bincount(
+        line_of_point[1:][same_line],
+        weights=distances[same_line],
+        minlength=len(lines),
+    )
+
+
+def geometry_lengths(geometries: List[dict]) -> List[Optional[float]]:
+    """Lengths of (Multi)LineStrings in meters, None for other geometries."""
+    lines = []
+    owners = []
+    for index, geometry in enumerate(geometries):
+        if geometry['type'] == 'LineString':
+            lines.append([c[:2] for c in geometry['coordinates']])
+            owners.append(index)
+        elif geometry['type'] == 'MultiLineString':
+            for part in geometry['coordinates']:
+                lines.append([c[:2] for c in part])
+                owners.append(index)
+    totals = np.bincount(
+        np.array(owners, dtype=int),
+        weights=line_lengths(lines),
+        minlength=len(geometries),
+    )
+    measured = set(owners)
+    return [
+        float(total) if index in measured else None
+        for index, total in enumerate(totals)
+    ]
@@ -0,0 +1,55 @@
+from datetime import datetime
+from typing import List
+
+import mapbox_vector_tile
+import shapely
+from shapely.geometry import shape
+
+from app.config import settings
+from .tiles import lonlat_to_mercator, tile_mercator_bounds
+
+
+def _tile_properties(feature: dict) -> dict:
+    # Vector tiles only carry scalar attributes
+    properties = {'id': feature['id']}
+    for key, value in feature['properties'].items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        if isinstance(value, (str, bool, int, float)):
+            properties[key] = value
+    return properties
+
+
+def encode_tile(
+    features: List[dict], z: int, x: int, y: int, layer: str = 'segments'
+) -> bytes:
+    """
+    Encode GeoJSON-like features in WGS84 as a Mapbox Vector Tile.
+
+    Geometries are projected to web mercator, clipped to the tile plus a
+    buffer and quantized to the tile extent.
+    """
+    bounds = tile_mercator_bounds(z, x, y)
+    buffer = (bounds[2] - bounds[0]) * settings.tile_buffer / settings.tile_extent
+    clip_bounds = (
+        bounds[0] - buffer, bounds[1] - buffer, bounds[2] + buffer, bounds[3] + buffer
+    )
+
+    tile_features = []
+    for feature in features:
+        geometry = shapely.transform(shape(feature['geometry']), lonlat_to_mercator)
+        geometry = shapely.clip_by_rect(geometry, *clip_bounds)
+        if geometry.is_empty:
+            continue
+        tile_features.append({
+            'geometry': geometry,
+            'properties': _tile_properties(feature),
+        })
+
+    return mapbox_vector_tile.encode(
+        [{'name': layer, 'features': tile_features}],
+        default_options={
+            'quantize_bounds': bounds,
+            'extents': settings.tile_extent,
+        },
+    )
@@ -0,0 +1,72 @@
+from typing import List
+
+import numpy as np
+
+from app.config import settings
+
+TILE_SIZE = 256
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """Size of a screen pixel in degrees at the given web map zoom level."""
+    return 360 / (TILE_SIZE * 2 ** zoom) * settings.simplify_tolerance_pixels
+
+
+def simplify_lines(lines: List[np.ndarray], tolerance: float) -> List[np.ndarray]:
+    """
+    Douglas-Peucker simplification of many lines at once.
+
+    All coordinates are concatenated into a single array and every pending
+    (start, end) range of every line is refined in the same NumPy pass, so
+    the number of Python level iterations is the recursion depth rather
+    than the number of vertices.
+    """
+    if not lines:
+        return []
+    lengths = np.array([len(line) for line in lines])
+    coords = np.concatenate(lines).astype(float)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    keep = np.zeros(len(coords), dtype=bool)
+    keep[offsets[:-1]] = True
+    keep[offsets[1:] - 1] = True
+
+    starts = offsets[:-1]
+    ends = offsets[1:] - 1
+    while len(starts):
+        counts = ends - starts - 1
+        has_interior = counts > 0
+        starts, ends, counts = (
+            starts[has_interior], ends[has_interior], counts[has_interior]
+        )
+        if not len(starts):
+            break
+
+        # Indices of all interior points of all ranges, grouped by range
+        range_ids = np.repeat(np.arange(len(starts)), counts)
+        firsts = np.cumsum(counts) - counts
+        points = starts[range_ids] + 1 + np.arange(counts.sum()) - firsts[range_ids]
+
+        a = coords[starts][range_ids]
+        ab = coords[ends][range_ids] - a
+        ap = coords[points] - a
+        chord = np.hypot(ab[:, 0], ab[:, 1])
+        cross = np.abs(ab[:, 0] * ap[:, 1] - ab[:, 1] * ap[:, 0])
+        distances = np.where(
+            chord > 0,
+            cross / np.where(chord > 0, chord, 1),
+            np.hypot(ap[:, 0], ap[:, 1]),
+        )
+
+        max_distances = np.maximum.reduceat(distances, firsts)
+        is_max = distances == max_distances[range_ids]
+        positions = np.where(is_max, np.arange(len(distances)), len(distances))
+        splits = points[np.minimum.reduceat(positions, firsts)]
+
+        refine = max_distances > tolerance
+        keep[splits[refine]] = True
+        starts = np.concatenate([starts[refine], splits[refine]])
+        ends = np.concatenate([splits[refine], ends[refine]])
+
+    kept_counts = np.add.reduceat(keep, offsets[:-1])
+    return np.split(coords[keep], np.cumsum(kept_counts)[:-1])
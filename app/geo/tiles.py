@@ -0,0 +1,172 @@
+import math
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+# Spherical (web) mercator, EPSG:3857
+EARTH_RADIUS = 6378137.0
+ORIGIN_SHIFT = math.pi * EARTH_RADIUS
+MAX_LATITUDE = 85.0511287798066
+
+Bounds = Tuple[float, float, float, float]
+
+
+class TileRange(NamedTuple):
+    z: int
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+
+    @property
+    def bounds(self) -> Bounds:
+        west, _, _, north = tile_bounds(self.z, self.x0, self.y0)
+        _, south, east, _ = tile_bounds(self.z, self.x1, self.y1)
+        return (west, south, east, north)
+
+    def tiles(self) -> Iterator[Tuple[int, int]]:
+        for x in range(self.x0, self.x1 + 1):
+            for y in range(self.y0, self.y1 + 1):
+                yield x, y
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= 24 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z: int, x: int, y: int) -> Bounds:
+    """(west, south, east, north) of a XYZ tile in degrees."""
+    n = 2 ** z
+
+    def latitude(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y))
+
+
+def buffered_tile_bounds(z: int, x: int, y: int, buffer: float) -> Bounds:
+    """
+    Tile bounds grown by buffer, a fraction of the tile size.
+
+    Clamped to the valid lon/lat range, so edge tiles stay queryable.
+    """
+    west, south, east, north = tile_bounds(z, x, y)
+    lon_buffer = (east - west) * buffer
+    lat_buffer = (north - south) * buffer
+    return (
+        max(west - lon_buffer, -180),
+        max(south - lat_buffer, -MAX_LATITUDE),
+        min(east + lon_buffer, 180),
+        min(north + lat_buffer, MAX_LATITUDE),
+    )
+
+
+def tile_mercator_bounds(z: int, x: int, y: int) -> Bounds:
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    west = -ORIGIN_SHIFT + x * size
+    north = ORIGIN_SHIFT - y * size
+    return (west, north - size, west + size, north)
+
+
+def lonlat_to_mercator(coordinates: np.ndarray) -> np.ndarray:
+    lon = coordinates[:, 0]
+    lat = np.clip(coordinates[:, 1], -MAX_LATITUDE, MAX_LATITUDE)
+    return np.column_stack([
+        np.radians(lon) * EARTH_RADIUS,
+        np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * EARTH_RADIUS,
+    ])
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    n = 2 ** z
+    lat = math.radians(min(max(lat, -MAX_LATITUDE), MAX_LATITUDE))
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def bbox_tiles(bounds: Bounds, z: int) -> Iterator[Tuple[int, int]]:
+    """All tiles of zoom level z covering (west, south, east, north)."""
+    west, south, east, north = bounds
+    x0, y0 = lonlat_to_tile(west, north, z)
+    x1, y1 = lonlat_to_tile(east, south, z)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+def bounds_polygon(bounds: Bounds) -> List[List[float]]:
+    """Closed exterior ring of a bounding box, as used by SegmentQuery.bbox."""
+    west, south, east, north = bounds
+    return [[west, south], [east, south], [east, north], [west, north], [west, south]]
+
+
+# Edges are split into at most this many parts, and none shorter than a
+# hundredth of a degree
+GEODESIC_EDGE_PARTS = 64
+GEODESIC_EDGE_DEGREES = 0.01
+
+
+def geodesic_cover(area: shapely.Polygon) -> List[List[float]]:
+    """
+    Exterior ring whose geodesic edges enclose area as drawn in the plane.
+
+    MongoDB connects polygon vertices along great circles, so $geoIntersects
+    with this ring finds everything intersecting area in the plane, and a
+    little more to filter out afterwards. The edges are split, and the ring
+    padded by the most an arc of that length strays from a parallel.
+    """
+    west, south, east, north = area.bounds
+    extent = max(east - west, north - south)
+    edge = max(extent / GEODESIC_EDGE_PARTS, GEODESIC_EDGE_DEGREES)
+    # The bulge of an arc of d radians is at most d^2/16, at 45 degrees
+    padding = max(math.degrees(math.radians(edge) ** 2 / 16), 1e-6)
+    padded = area.buffer(padding, join_style="mitre").intersection(
+        shapely.box(-180, -90, 180, 90)
+    )
+    ring = shapely.segmentize(padded, edge).exterior
+    return [list(point) for point in ring.coords]
+
+
+def ring_bounds(ring: List[List[float]]) -> Bounds:
+    lons = [point[0] for point in ring]
+    lats = [point[1] for point in ring]
+    return (min(lons), min(lats), max(lons), max(lats))
+
+
+def snap_bbox(
+    ring: List[List[float]], min_zoom: int, max_zoom: int, max_tiles: int
+) -> Optional[TileRange]:
+    """
+    Snap a bounding box to the tile grid.
+
+    Picks the zoom level at which a tile is about as wide as the box, so
+    boxes panned by less than a tile share the same range. Returns None
+    if the box needs more than max_tiles tiles even at min_zoom.
+    """
+    west, south, east, north = ring_bounds(ring)
+    span = max(east - west, 1e-9)
+    z = min(max(int(math.log2(360 / span)), min_zoom), max_zoom)
+    x0, y0 = lonlat_to_tile(west, north, z)
+    x1, y1 = lonlat_to_tile(east, south, z)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > max_tiles:
+        return None
+    return TileRange(z, x0, y0, x1, y1)
+
+
+def geometry_tiles(geometry: dict, z: int) -> List[Tuple[int, int]]:
+    """Tiles of zoom level z a GeoJSON geometry actually touches."""
+    shape_ = shape(geometry)
+    candidates = list(bbox_tiles(shape_.bounds, z))
+    boxes = shapely.box(*np.array([tile_bounds(z, x, y) for x, y in candidates]).T)
+    touched = shapely.intersects(boxes, shape_)
+    return [tile for tile, hit in zip(candidates, touched) if hit]
+
+
+def first_coordinate(geometry: dict) -> List[float]:
+    coordinates = geometry['coordinates']
+    while isinstance(coordinates[0], (list, tuple)):
+        coordinates = coordinates[0]
+    return list(coordinates[:2])
@@ -1,14 +1,15 @@
 from sentry_sdk import init
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 
-from brotli_asgi import BrotliMiddleware
-
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 
+from app import controllers
 from app.app import app
-from app.routers import segments, users, clusters
+from app.middleware import CompressionMiddleware
+from app.routers import segments, users, clusters, statistics
 from app.config import settings
+from app.services import ensure_indexes
 
 
 origins = [
@@ -40,10 +41,44 @@ openapi_schema = get_openapi(
     routes=app.routes,
 )
 
-app.add_middleware(BrotliMiddleware)
+app.add_middleware(CompressionMiddleware)
 app.include_router(users.router)
 app.include_router(segments.router)
 app.include_router(clusters.router)
+app.include_router(statistics.router)
+
+
+@app.on_event("startup")
+async def create_indexes():
+    if settings.ensure_indexes_on_startup:
+        await ensure_indexes()
+        await controllers.delete_undated_sessions()
+
+
+@app.on_event("startup")
+async def start_email_service():
+    await users.email_service.start()
+
+
+@app.on_event("shutdown")
+async def stop_email_service():
+    await users.email_service.stop()
+
+
+@app.on_event("startup")
+async def start_segment_replica():
+    if settings.segment_replica_enabled:
+        await controllers.segment_replica.start()
+
+
+@app.on_event("shutdown")
+async def stop_segment_replica():
+    await controllers.segment_replica.stop()
+
+
+@app.on_event("shutdown")
+async def stop_live_feed():
+    await controllers.live_feed.stop()
 
 
 if settings.sentry_url:
@@ -0,0 +1,96 @@
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.services.compression import (
+    DYNAMIC_LEVELS, IDENTITY, StreamCompressor, negotiate
+)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses in the encoding negotiated from Accept-Encoding.
+
+    Compression runs in the threadpool, not on the event loop. Responses
+    that already carry a Content-Encoding, like cached payloads compressed
+    ahead of time, are passed through untouched.
+    """
+
+    def __init__(
+        self, app: ASGIApp, minimum_size: int = settings.compression_minimum_size
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            encoding = negotiate(Headers(scope=scope).get("Accept-Encoding"))
+            if encoding != IDENTITY:
+                responder = CompressionResponder(
+                    self.app, encoding, self.minimum_size
+                )
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Send = None
+        self.start_message: Message = None
+        self.compressor: StreamCompressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            self.passthrough = "content-encoding" in Headers(raw=message["headers"])
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._flush_start()
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self._flush_start()
+                await self.send(message)
+                return
+            self.compressor = StreamCompressor(
+                self.encoding, DYNAMIC_LEVELS[self.encoding]
+            )
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            del headers["Content-Length"]
+            if not more_body:
+                body = await run_in_threadpool(self._compress_all, body)
+                headers["Content-Length"] = str(len(body))
+                await self._flush_start()
+                await self.send({**message, "body": body})
+                return
+            await self._flush_start()
+
+        body = await run_in_threadpool(self.compressor.compress, body)
+        if not more_body:
+            body += await run_in_threadpool(self.compressor.finish)
+        await self.send({**message, "body": body})
+
+    def _compress_all(self, body: bytes) -> bytes:
+        return self.compressor.compress(body) + self.compressor.finish()
+
+    async def _flush_start(self) -> None:
+        if self.start_message is not None:
+            await self.send(self.start_message)
+            self.start_message = None
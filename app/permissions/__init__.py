@@ -1 +1 @@
-from .permissions import user_can_operate  # noqa
+from .permissions import user_can_operate, access_levels  # noqa
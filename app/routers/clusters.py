@@ -1,7 +1,10 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import ORJSONResponse
 
 from app import controllers
+from app.services import (
+    collection_validators, compressed_response, negotiate, response_cache
+)
 
 router = APIRouter()
 
@@ -10,6 +13,27 @@ router = APIRouter()
     "/clusters/",
     response_class=ORJSONResponse,
 )
-async def read_clusters():
-    clusters = await controllers.get_clusters()
-    return ORJSONResponse(clusters)
+async def read_clusters(request: Request, full_geometry: bool = False):
+    # Cluster stats follow the segments
+    validators = await collection_validators(
+        ["clusters", "segments"], "clusters", full_geometry
+    )
+    not_modified = validators.not_modified(request)
+    if not_modified:
+        return not_modified
+    if not response_cache.enabled:
+        # Left to the compression middleware, at its faster levels
+        return ORJSONResponse(
+            content=await controllers.get_clusters(full_geometry=full_geometry),
+            headers=validators.headers,
+        )
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    payload = await response_cache.get_or_set(
+        f"clusters:{validators.revision}:{full_geometry}",
+        ["clusters"],
+        lambda: controllers.get_clusters(full_geometry=full_geometry),
+        encoding=encoding,
+    )
+    response = compressed_response(payload, encoding)
+    response.headers.update(validators.headers)
+    return response
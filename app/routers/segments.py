@@ -1,36 +1,236 @@
-from fastapi import Depends, APIRouter, HTTPException, WebSocket, Request
-from fastapi.responses import PlainTextResponse, ORJSONResponse
+import asyncio
+import os
+import tempfile
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import orjson
+from fastapi import (
+    Depends, APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Request, Header
+)
+from fastapi.responses import (
+    FileResponse, PlainTextResponse, ORJSONResponse, Response, StreamingResponse
+)
+from starlette.background import BackgroundTask
+from pydantic import ValidationError
+from shapely.errors import GEOSException
+from shapely.geometry import Polygon
 
 from app import schemas, controllers
+from app.config import settings
+from app.geo import bounds_polygon, snap_bbox, valid_tile
+from app.services import (
+    Validators,
+    collection_validators,
+    compressed_response,
+    negotiate,
+    response_cache,
+    tile_tag,
+)
+from app.strings import validation
 from app.routers.users import get_session
 from ..services import db
 
 router = APIRouter()
 
 
+def version_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def parse_version_etag(etag: str) -> Optional[int]:
+    """The version an If-Match header expects, None for any version."""
+    etag = etag.strip()
+    if etag == "*":
+        return None
+    try:
+        return int(etag.removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=412, detail=validation["version_conflict"])
+
+
 @router.post(
     "/query-segments/",
     response_class=PlainTextResponse,
 )
 async def query_segments(
     body: schemas.SegmentQuery,
+    request: Request,
 ):
+    validators = await collection_validators(
+        ["segments"], "query-segments", body.dict()
+    )
+    not_modified = validators.not_modified(request)
+    if not_modified:
+        return not_modified
+
+    tiles = None
+    # Incremental sync queries depend on what the client holds, don't cache them
+    if response_cache.enabled and not (
+        body.exclude_ids or body.include_if_modified_after
+    ):
+        tiles = snap_bbox(
+            body.bbox,
+            settings.cache_min_zoom,
+            settings.cache_max_zoom,
+            settings.cache_max_tiles,
+        )
+    if tiles is None:
+        result = await controllers.query_segments(
+            bbox=body.bbox,
+            exclude_ids=body.exclude_ids,
+            include_if_modified_after=body.include_if_modified_after,
+            details=body.details,
+            zoom=body.zoom,
+        )
+        return ORJSONResponse(content=result, headers=validators.headers)
 
-    result = await controllers.query_segments(
-        bbox=body.bbox,
-        exclude_ids=body.exclude_ids,
-        include_if_modified_after=body.include_if_modified_after,
+    zoom = None if body.zoom is None else int(body.zoom)
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    key = f"{'/'.join(map(str, tiles))}:{body.details}:{zoom}"
+    payload = await response_cache.get_or_set(
+        f"query-segments:{validators.revision}:{key}",
+        [tile_tag(tiles.z, x, y) for x, y in tiles.tiles()],
+        lambda: controllers.query_segments(
+            bbox=bounds_polygon(tiles.bounds),
+            details=body.details,
+            zoom=zoom,
+            within=tiles.bounds,
+        ),
+        encoding=encoding,
     )
-    return ORJSONResponse(content=result)
+    response = compressed_response(payload, encoding)
+    response.headers.update(validators.headers)
+    return response
+
+
+async def _receive_subscription(websocket: WebSocket) -> schemas.LiveSubscription:
+    try:
+        message = await websocket.receive_text()
+        subscription = schemas.LiveSubscription.parse_raw(message)
+        # Subscriptions test every change against the area, it has to be usable
+        if len(subscription.bbox) < 4 or not Polygon(subscription.bbox).is_valid:
+            raise ValueError(validation["bbox"])
+    except (ValidationError, ValueError, GEOSException):
+        await websocket.close(code=1008)
+        raise WebSocketDisconnect(code=1008)
+    return subscription
+
+
+@router.websocket("/segments/live")
+async def live_segments(websocket: WebSocket):
+    """
+    Push segment changes within a bbox, instead of polling /query-segments/.
+
+    The client sends {"bbox": [...]} to subscribe and again to move the area,
+    and receives batches of {"events": [{"type": "create" | "update" | "delete",
+    "id": ..., "feature": ...}]}.
+    """
+    await websocket.accept()
+    try:
+        body = await _receive_subscription(websocket)
+    except WebSocketDisconnect:
+        return
+    subscription = controllers.live_feed.subscribe(body.bbox)
+
+    async def receive():
+        while True:
+            subscription.set_bbox((await _receive_subscription(websocket)).bbox)
+
+    async def send():
+        while True:
+            events = await subscription.next_batch(controllers.live_feed.batch_seconds)
+            await websocket.send_text(orjson.dumps({"events": events}).decode())
+
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(send())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await controllers.live_feed.unsubscribe(subscription)
+
+
+export_media_types = {
+    schemas.ExportFormat.geojson: "application/geo+json",
+    schemas.ExportFormat.ndjson: "application/x-ndjson",
+    schemas.ExportFormat.geojsonseq: "application/geo+json-seq",
+}
 
 
 @router.get(
     "/segments/",
-    response_class=ORJSONResponse,
+    response_class=StreamingResponse,
+)
+async def read_segments(
+    request: Request,
+    format: schemas.ExportFormat = schemas.ExportFormat.geojson,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    order_by: schemas.SegmentOrder = schemas.SegmentOrder.id,
+):
+    validators = await collection_validators(
+        ["segments"], "segments", format, limit, cursor, order_by
+    )
+    not_modified = validators.not_modified(request)
+    if not_modified:
+        return not_modified
+
+    if limit or cursor:
+        limit = min(limit or settings.page_max_limit, settings.page_max_limit)
+        page = await controllers.get_segments(
+            limit=max(limit, 1),
+            cursor=cursor,
+            order_by=order_by,
+        )
+        return ORJSONResponse(content=page, headers=validators.headers)
+    return StreamingResponse(
+        controllers.stream_segments(format=format),
+        media_type=export_media_types[format],
+        headers=validators.headers,
+    )
+
+
+@router.get(
+    "/segments/export/{table}.parquet",
+    response_class=FileResponse,
 )
-async def read_segments():
-    db_segments = await controllers.get_segments()
-    return ORJSONResponse(content=db_segments)
+async def export_segments_parquet(request: Request, table: schemas.ExportTable):
+    validators = await collection_validators(["segments"], "parquet", table)
+    not_modified = validators.not_modified(request)
+    if not_modified:
+        return not_modified
+    # Parquet writes its footer last, so the file is built before sending it
+    with tempfile.NamedTemporaryFile(suffix=".parquet", delete=False) as file:
+        try:
+            await controllers.write_parquet({table: file})
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    return FileResponse(
+        file.name,
+        media_type="application/vnd.apache.parquet",
+        filename=f"{table.value}.parquet",
+        headers=validators.headers,
+        background=BackgroundTask(os.unlink, file.name),
+    )
+
+
+@router.get(
+    "/segments/tiles/{z}/{x}/{y}.mvt",
+    response_class=Response,
+)
+async def read_segment_tile(z: int, x: int, y: int):
+    if not valid_tile(z, x, y):
+        raise HTTPException(status_code=400, detail=validation["tile"])
+    if z < settings.tile_min_zoom:
+        raise HTTPException(status_code=400, detail=validation["tile_zoom"])
+    tile = await controllers.get_segment_tile(z=z, x=x, y=y)
+    return Response(
+        content=tile,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers={"Cache-Control": f"public, max-age={settings.tile_max_age}"},
+    )
 
 
 @router.get(
@@ -43,7 +243,16 @@ async def read_segment(
     segment = await controllers.get_segment(segment_id=segment_id)
 
     if not segment:
-        HTTPException(status_code=404)
+        raise HTTPException(status_code=404, detail=validation["segment_not_found"])
+    # Same ETag as PUT and PATCH take in If-Match
+    validators = Validators(
+        version_etag(segment['properties'].get('version', 0)),
+        segment['properties'].get('modified_at'),
+    )
+    not_modified = validators.not_modified(request)
+    if not_modified:
+        return not_modified
+    response.headers.update(validators.headers)
     return segment
 
 
@@ -57,6 +266,59 @@ async def create_segment(
     return await controllers.create_segment(segment=segment, user_id=user['id'])
 
 
+sequence_media_types = {"application/x-ndjson", "application/geo+json-seq"}
+
+
+async def _read_features(request: Request) -> AsyncIterator[Any]:
+    media_type = request.headers.get("Content-Type", "").split(";")[0].strip()
+    if media_type in sequence_media_types:
+        # One feature per line, optionally prefixed with a record separator
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip(b"\x1e \r\t"):
+                    yield _parse_feature(line)
+        if buffer.strip(b"\x1e \r\t"):
+            yield _parse_feature(buffer)
+        return
+
+    try:
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail=validation["bulk"])
+    if isinstance(body, dict) and body.get("type") == "FeatureCollection":
+        body = body.get("features", [])
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail=validation["bulk"])
+    for feature in body:
+        yield feature
+
+
+def _parse_feature(line: bytes) -> Any:
+    try:
+        return orjson.loads(line.strip(b"\x1e"))
+    except orjson.JSONDecodeError:
+        # Reported as a validation error for this feature
+        return None
+
+
+@router.post(
+    "/segments/bulk/",
+    response_class=ORJSONResponse,
+    dependencies=[Depends(get_session)],
+)
+async def bulk_upsert_segments(
+    request: Request,
+    user: dict = Depends(get_session),
+):
+    result = await controllers.bulk_upsert_segments(
+        features=_read_features(request), user=user
+    )
+    return ORJSONResponse(content=result)
+
+
 @router.delete(
     "/segments/{segment_id}/", response_model=str, dependencies=[Depends(get_session)]
 )
@@ -79,10 +341,66 @@ async def update_segment(
     segment_id: str,
     segment: dict,
     user=Depends(get_session),
+    if_match: Optional[str] = Header(None),
 ):
+    expected_version = segment.get('properties', {}).get('version')
+    if if_match is not None:
+        expected_version = parse_version_etag(if_match)
     result = await controllers.update_segment(
-        segment_id=segment_id, segment=segment, user=user
+        segment_id=segment_id,
+        segment=segment,
+        user=user,
+        expected_version=expected_version,
+    )
+    return ORJSONResponse(
+        content=result,
+        headers={"ETag": version_etag(result['properties']['version'])},
+    )
+
+
+@router.patch(
+    "/segments/{segment_id}/",
+    response_class=ORJSONResponse,
+    dependencies=[Depends(get_session)],
+)
+async def patch_segment(
+    segment_id: str,
+    operations: List[schemas.PatchOperation],
+    user=Depends(get_session),
+    if_match: Optional[str] = Header(None),
+):
+    result = await controllers.patch_segment(
+        segment_id=segment_id,
+        operations=operations,
+        user=user,
+        expected_version=parse_version_etag(if_match) if if_match else None,
+    )
+    return ORJSONResponse(
+        content=result,
+        headers={"ETag": version_etag(result['properties']['version'])},
+    )
+
+
+@router.patch(
+    "/segments/{segment_id}/subsegments/{order_number}",
+    response_class=ORJSONResponse,
+    dependencies=[Depends(get_session)],
+)
+async def patch_subsegment(
+    segment_id: str,
+    order_number: int,
+    changes: Dict[str, Any],
+    user=Depends(get_session),
+    if_match: Optional[str] = Header(None),
+):
+    result = await controllers.patch_subsegment(
+        segment_id=segment_id,
+        order_number=order_number,
+        changes=changes,
+        user=user,
+        expected_version=parse_version_etag(if_match) if if_match else None,
+    )
+    return ORJSONResponse(
+        content=result,
+        headers={"ETag": version_etag(result['properties']['version'])},
     )
-    if not result:
-        HTTPException(status_code=404)
-    return result
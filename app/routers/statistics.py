@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Request, Response
+
+from app import schemas, controllers
+from app.services import collection_validators
+
+router = APIRouter()
+
+
+@router.post(
+    "/statistics/",
+    response_model=schemas.Statistics,
+)
+async def read_statistics(
+    body: schemas.StatisticsQuery, request: Request, response: Response
+):
+    geometry = body.geometry.dict(exclude_none=True)
+    validators = await collection_validators(["segments"], "statistics", geometry)
+    not_modified = validators.not_modified(request)
+    if not_modified:
+        return not_modified
+    response.headers.update(validators.headers)
+    return await controllers.get_statistics(geometry=geometry)
@@ -1,10 +1,10 @@
 from typing import Optional
 
-from fastapi import HTTPException, BackgroundTasks, Depends, APIRouter, Cookie
+from fastapi import HTTPException, Depends, APIRouter, Cookie
 from fastapi.responses import RedirectResponse, ORJSONResponse
 
 from app import controllers
-from app.services import OneTimeAuth, EmailService
+from app.services import OneTimeAuth, EmailService, RateLimit, body_field
 from app.strings import validation
 from app.config import settings
 
@@ -30,15 +30,23 @@ async def get_session(
         raise HTTPException(401, validation["unauthorized"])
 
 
-@router.post("/users/", response_class=ORJSONResponse)
-def send_magic_link(
+@router.post(
+    "/users/",
+    response_class=ORJSONResponse,
+    dependencies=[
+        Depends(RateLimit("magic-link-ip", settings.magic_link_ip_limit)),
+        Depends(RateLimit(
+            "magic-link-email",
+            settings.magic_link_email_limit,
+            key=body_field("email"),
+        )),
+    ],
+)
+async def send_magic_link(
     user: dict,
-    background_tasks: BackgroundTasks
 ):
     token = one_time_auth.generate_token(user['email'])
-    background_tasks.add_task(
-        email_service.send_email_verification_link, user['email'], token
-    )
+    await email_service.send_email_verification_link(user['email'], token)
     return user
 
 
@@ -58,7 +66,7 @@ async def verify_magic_link(
             decoded["sub"]
         )
 
-    session_id = await controllers.create_session(user_id=user['id'])
+    session_id = await controllers.create_session(user=user)
 
     response = RedirectResponse(
         "http://localhost:3000" if dev else settings.frontend_url
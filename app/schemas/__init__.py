@@ -7,5 +7,12 @@ from .segment import (  # noqa
     Subsegment,
     SegmentCollection,
     SegmentQuery,
+    ExportFormat,
+    SegmentOrder,
+    ExportTable,
+    LiveSubscription,
+    PatchOp,
+    PatchOperation,
 )
 from .cluster import Cluster, ClusterCollection # noqa
+from .statistics import Statistics, StatisticsQuery  # noqa
@@ -6,9 +6,25 @@ from geojson_pydantic.features import FeatureCollection
 from geojson_pydantic.geometries import Geometry
 
 
+class ParkingStats(BaseModel):
+    car_count: int = 0
+    length_in_meters: float = 0
+    subsegment_count: int = 0
+
+
+class ParkingAllowedStats(BaseModel):
+    allowed: ParkingStats = ParkingStats()
+    not_allowed: ParkingStats = ParkingStats()
+
+
 class Properties(BaseModel):
     name: str
+    centroid: Optional[List[float]]
+    # Total car_count of the segments in the cluster
     count: int = 0
+    segment_count: int = 0
+    length_in_meters: float = 0
+    parking_allowed: ParkingAllowedStats = ParkingAllowedStats()
 
 
 class Cluster(Feature):
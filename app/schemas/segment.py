@@ -1,5 +1,5 @@
 import enum
-from typing import Optional, List
+from typing import Any, Optional, List
 from datetime import date, datetime
 from uuid import uuid4
 
@@ -62,6 +62,22 @@ class AlternativeUsageReason(str, enum.Enum):
     other = "other"
 
 
+class ExportFormat(str, enum.Enum):
+    geojson = "geojson"
+    ndjson = "ndjson"
+    geojsonseq = "geojsonseq"
+
+
+class ExportTable(str, enum.Enum):
+    segments = "segments"
+    subsegments = "subsegments"
+
+
+class SegmentOrder(str, enum.Enum):
+    id = "id"
+    modified_at = "modified_at"
+
+
 class SubsegmentBase(BaseModel):
     parking_allowed: bool
     order_number: int = 0
@@ -87,6 +103,9 @@ class SubsegmentBase(BaseModel):
 
 
 class Subsegment(SubsegmentBase):
+    # Derived from length_in_meters and alignment when car_count is unknown
+    estimated_car_count: Optional[int]
+
     class Config:
         orm_mode = True
 
@@ -99,10 +118,14 @@ class Properties(BaseModel):
     subsegments: List[Subsegment]
     has_subsegments: Optional[bool]
     owner_id: Optional[str]
+    cluster_id: Optional[str]
     data_source: Optional[str]
     further_comments: Optional[str]
     modified_at: Optional[datetime]
     created_at: Optional[datetime]
+    version: Optional[int]
+    # Geodesic length of a (Multi)LineString geometry
+    length_in_meters: Optional[float]
 
 
 class Segment(Feature):
@@ -142,5 +165,24 @@ class SegmentUpdate(SegmentCreate):
 class SegmentQuery(BaseModel):
     bbox: List[List[float]]
     details: bool
-    exclude_ids: List[str]
+    exclude_ids: List[str] = []
     include_if_modified_after: Optional[datetime]
+    # Web map zoom level, geometries are simplified to its pixel size when set
+    zoom: Optional[float]
+
+
+class LiveSubscription(BaseModel):
+    """Sent over /segments/live to start or move the watched area."""
+    bbox: List[List[float]]
+
+
+class PatchOp(str, enum.Enum):
+    add = "add"
+    remove = "remove"
+    replace = "replace"
+
+
+class PatchOperation(BaseModel):
+    op: PatchOp
+    path: str
+    value: Any
@@ -0,0 +1,22 @@
+from typing import Dict, Union
+
+from pydantic import BaseModel
+from geojson_pydantic.geometries import MultiPolygon, Polygon
+
+from .cluster import ParkingAllowedStats, ParkingStats
+
+
+class StatisticsQuery(BaseModel):
+    geometry: Union[Polygon, MultiPolygon]
+
+
+class Statistics(BaseModel):
+    segment_count: int = 0
+    parking_allowed: ParkingAllowedStats = ParkingAllowedStats()
+    # Parking allowed subsegments, keyed by value, "unknown" where unset
+    street_location: Dict[str, ParkingStats] = {}
+    alignment: Dict[str, ParkingStats] = {}
+    fee: Dict[str, ParkingStats] = {}
+    user_restriction_reason: Dict[str, ParkingStats] = {}
+    # Parking not allowed subsegments, counted once per reason they list
+    no_parking_reasons: Dict[str, ParkingStats] = {}
@@ -1,3 +1,11 @@
-from .email import EmailService  # noqa
+from .email import EmailService, MailgunTransport, FakeTransport  # noqa
 from .one_time_auth import OneTimeAuth, decode_jwt  # noqa
 from .database import db  # noqa
+from .signed_sessions import SessionSigner, RevocationList  # noqa
+from .compression import negotiate  # noqa
+from .cache import LRUCache, response_cache, compressed_response, tile_tag  # noqa
+from .indexes import ensure_indexes  # noqa
+from .rate_limit import RateLimit, client_ip, body_field  # noqa
+from .conditional import Validators, bump_counter, collection_validators  # noqa
+from .live_feed import LiveFeed, Subscription  # noqa
+from .segment_replica import SegmentReplica  # noqa
@@ -0,0 +1,336 @@
+import time
+from collections import OrderedDict, defaultdict, deque
+from typing import Any, Awaitable, Callable, Hashable, Iterable, List, Optional
+
+import orjson
+from fastapi import Response
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.geo import geometry_tiles
+from .compression import DYNAMIC_LEVELS, IDENTITY, compress, decompress
+from .redis import get_redis
+
+
+class LRUCache:
+    """Bounded mapping evicting the least recently used entry, with optional TTL."""
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        on_evict: Optional[Callable[[Hashable], None]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Called with the key of entries dropped for size or expiry
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            self._evicted(key)
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            evicted, _ = self._entries.popitem(last=False)
+            self._evicted(evicted)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def pop_matching(self, predicate: Callable[[Any], bool]):
+        """Drop every entry whose value matches the predicate."""
+        for key in [k for k, (_, v) in self._entries.items() if predicate(v)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def _evicted(self, key: Hashable):
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self) is not self
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class MemoryCacheBackend:
+    """
+    Process local cache tier, for tests and single worker deployments.
+
+    Every invalidation increments a generation. The latest invalidations
+    are logged, so set can tell whether one of its tags was invalidated
+    since the stamp taken before the value was built.
+    """
+
+    invalidation_log_size = 1024
+
+    def __init__(self, maxsize: int = settings.cache_max_entries):
+        self.entries = LRUCache(maxsize, on_evict=self._forget)
+        self.tags = defaultdict(set)
+        self.key_tags = {}
+        self.generation = 0
+        self.invalidations = deque(maxlen=self.invalidation_log_size)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.entries.get(key)
+
+    async def stamp(self, tags: Iterable[str]) -> int:
+        return self.generation
+
+    async def set(
+        self,
+        key: str,
+        value: bytes,
+        tags: Iterable[str],
+        ttl: int,
+        stamp: Optional[int] = None,
+    ):
+        tags = set(tags)
+        if stamp is not None and self._invalidated_since(stamp, tags):
+            return
+        self._forget(key)
+        self.entries.set(key, value, ttl)
+        self.key_tags[key] = tags
+        for tag in tags:
+            self.tags[tag].add(key)
+
+    async def invalidate_tags(self, tags: Iterable[str]):
+        tags = set(tags)
+        self.generation += 1
+        self.invalidations.append((self.generation, tags))
+        for tag in tags:
+            for key in list(self.tags.get(tag, ())):
+                self.entries.pop(key)
+                self._forget(key)
+
+    async def clear(self):
+        self.entries.clear()
+        self.tags.clear()
+        self.key_tags.clear()
+        # Without a log reaching back, every earlier stamp counts as stale
+        self.generation += 1
+        self.invalidations.clear()
+
+    def _invalidated_since(self, stamp: int, tags: set) -> bool:
+        if stamp == self.generation:
+            return False
+        if not self.invalidations or self.invalidations[0][0] > stamp + 1:
+            return True
+        return any(
+            generation > stamp and not tags.isdisjoint(invalidated)
+            for generation, invalidated in self.invalidations
+        )
+
+    def _forget(self, key: str):
+        for tag in self.key_tags.pop(key, ()):
+            keys = self.tags.get(tag)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self.tags[tag]
+
+
+class RedisCacheBackend:
+    """
+    Shared cache tier for deployments running several workers.
+
+    Each tag has a generation counter, incremented when it is invalidated.
+    set watches the counters and skips the write if they changed since
+    the stamp taken before the value was built.
+    """
+
+    prefix = "response-cache:"
+    # Outside the prefix, so clear does not reset it
+    clear_generation = "response-cache-generation"
+
+    def __init__(self):
+        self.redis = get_redis()
+
+    def _generation_keys(self, tags: Iterable[str]) -> List[str]:
+        return [self.clear_generation] + [
+            f"{self.prefix}generation:{tag}" for tag in tags
+        ]
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.redis.get(self.prefix + key)
+
+    async def stamp(self, tags: Iterable[str]) -> list:
+        return await self.redis.mget(self._generation_keys(tags))
+
+    async def set(
+        self,
+        key: str,
+        value: bytes,
+        tags: Iterable[str],
+        ttl: int,
+        stamp: Optional[list] = None,
+    ):
+        from redis.exceptions import WatchError
+
+        tags = list(tags)
+        generation_keys = self._generation_keys(tags)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                if stamp is not None:
+                    await pipe.watch(*generation_keys)
+                    if await pipe.mget(generation_keys) != stamp:
+                        return
+                    pipe.multi()
+                pipe.set(self.prefix + key, value, ex=ttl)
+                for tag in tags:
+                    pipe.sadd(self.prefix + tag, key)
+                    pipe.expire(self.prefix + tag, ttl)
+                await pipe.execute()
+            except WatchError:
+                pass
+
+    async def invalidate_tags(self, tags: Iterable[str]):
+        tags = list(tags)
+        if not tags:
+            return
+        tag_keys = [self.prefix + tag for tag in tags]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for generation_key in self._generation_keys(tags)[1:]:
+                pipe.incr(generation_key)
+                pipe.expire(generation_key, settings.cache_ttl)
+            await pipe.execute()
+        keys = await self.redis.sunion(tag_keys)
+        await self.redis.delete(
+            *tag_keys, *(self.prefix + key.decode() for key in keys)
+        )
+
+    async def clear(self):
+        await self.redis.incr(self.clear_generation)
+        async for key in self.redis.scan_iter(self.prefix + "*"):
+            await self.redis.delete(key)
+
+
+def tile_tag(z: int, x: int, y: int) -> str:
+    return f"tile:{z}/{x}/{y}"
+
+
+class ResponseCache:
+    """
+    Cache of serialized, Brotli compressed response bodies.
+
+    Entries are tagged with the tiles they cover, so a segment write only
+    evicts entries overlapping the tiles its old and new geometry touch.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def get_or_set(
+        self,
+        key: str,
+        tags: List[str],
+        build: Callable[[], Awaitable[Any]],
+        encoding: str = "br",
+    ) -> bytes:
+        """
+        The payload for key in the given encoding.
+
+        The Brotli payload is built first, other encodings are derived from it
+        on first request and cached alongside, so every variant is
+        compressed only once and never on the event loop.
+
+        Without a backend the payload is compressed once, straight into the
+        requested encoding at the dynamic levels, though callers are better
+        off leaving uncached responses to the compression middleware.
+
+        The tags are stamped before building. If a write invalidates one
+        of them in the meantime, the built payload is returned but not
+        cached, as it may predate the write.
+        """
+        if not self.enabled:
+            return await run_in_threadpool(
+                compress,
+                orjson.dumps(await build()),
+                encoding,
+                DYNAMIC_LEVELS.get(encoding),
+            )
+        variant = key if encoding == "br" else f"{key}|{encoding}"
+        cached = await self.backend.get(variant)
+        if cached is not None:
+            return cached
+        stamp = await self.backend.stamp(tags)
+        payload = None
+        if variant != key:
+            payload = await self.backend.get(key)
+        if payload is None:
+            payload = await run_in_threadpool(_serialize, await build())
+            await self.backend.set(key, payload, tags, settings.cache_ttl, stamp=stamp)
+        if variant == key:
+            return payload
+        payload = await run_in_threadpool(_recompress, payload, encoding)
+        await self.backend.set(variant, payload, tags, settings.cache_ttl, stamp=stamp)
+        return payload
+
+    async def invalidate(self, tags: Iterable[str]):
+        if self.enabled:
+            await self.backend.invalidate_tags(tags)
+
+    async def clear(self):
+        if self.enabled:
+            await self.backend.clear()
+
+    async def invalidate_geometries(self, geometries: Iterable[Optional[dict]]):
+        if not self.enabled:
+            return
+        tags = set()
+        for geometry in geometries:
+            if not geometry:
+                continue
+            for z in range(settings.cache_min_zoom, settings.cache_max_zoom + 1):
+                tags.update(tile_tag(z, x, y) for x, y in geometry_tiles(geometry, z))
+        await self.backend.invalidate_tags(tags)
+
+
+def _serialize(content: Any) -> bytes:
+    return compress(orjson.dumps(content), "br")
+
+
+def _recompress(payload: bytes, encoding: str) -> bytes:
+    return compress(decompress(payload, "br"), encoding)
+
+
+def compressed_response(payload: bytes, encoding: str) -> Response:
+    """Send a payload get_or_set compressed, the middleware passes it through."""
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding != IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return Response(payload, media_type="application/json", headers=headers)
+
+
+def _create_backend():
+    if settings.cache_backend == "memory":
+        return MemoryCacheBackend()
+    if settings.cache_backend == "redis":
+        return RedisCacheBackend()
+    return None
+
+
+response_cache = ResponseCache(_create_backend())
@@ -0,0 +1,90 @@
+import zlib
+from typing import Optional
+
+import brotli
+import zstandard
+
+from app.config import settings
+
+# Preferred first when a client accepts several encodings equally
+ENCODINGS = ("br", "zstd", "gzip")
+IDENTITY = "identity"
+
+# Cached payloads are compressed once, so they can afford slower levels
+CACHED_LEVELS = {
+    "br": settings.cache_brotli_quality,
+    "zstd": settings.cache_zstd_level,
+    "gzip": settings.cache_gzip_level,
+}
+DYNAMIC_LEVELS = {
+    "br": settings.compression_brotli_quality,
+    "zstd": settings.compression_zstd_level,
+    "gzip": settings.compression_gzip_level,
+}
+
+
+def negotiate(accept_encoding: Optional[str]) -> str:
+    """Pick the best encoding the client accepts, by q-value then preference."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if name:
+            accepted[name.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = IDENTITY, 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class StreamCompressor:
+    """Incremental compressor with the same interface for every encoding."""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=level)
+        elif encoding == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        elif encoding == "gzip":
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        else:
+            raise ValueError(f"Unsupported encoding {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.process(data)
+        return self.compressor.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == IDENTITY:
+        return data
+    if level is None:
+        level = CACHED_LEVELS[encoding]
+    compressor = StreamCompressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.decompress(data)
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if encoding == "gzip":
+        return zlib.decompress(data, 31)
+    return data
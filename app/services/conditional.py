@@ -0,0 +1,89 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Iterable, NamedTuple, Optional
+
+import orjson
+from fastapi import Request, Response
+
+from .database import db
+
+# name -> {'value': number of writes, 'modified_at': time of the last write}
+counter_collection = db['counters']
+
+
+async def bump_counter(name: str):
+    """Record a write, invalidating every validator derived from the counter."""
+    await counter_collection.update_one(
+        {'_id': name},
+        {'$inc': {'value': 1}, '$currentDate': {'modified_at': True}},
+        upsert=True,
+    )
+
+
+def _parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Validators(NamedTuple):
+    """ETag and Last-Modified of a response, checked before it is built."""
+    etag: str
+    last_modified: Optional[datetime] = None
+    # Digest of the counter values alone, the same for every key
+    revision: str = ""
+
+    @property
+    def headers(self) -> dict:
+        headers = {"ETag": self.etag}
+        if self.last_modified is not None:
+            last_modified = self.last_modified.replace(tzinfo=timezone.utc)
+            headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+        return headers
+
+    def matches(self, request: Request) -> bool:
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            etags = {
+                etag.strip().removeprefix("W/") for etag in if_none_match.split(",")
+            }
+            return "*" in etags or self.etag in etags
+        if_modified_since = _parse_http_date(request.headers.get("If-Modified-Since"))
+        if if_modified_since is None or self.last_modified is None:
+            return False
+        last_modified = self.last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+        return last_modified <= if_modified_since
+
+    def not_modified(self, request: Request) -> Optional[Response]:
+        """A 304 response if the client's copy is current, otherwise None."""
+        if not self.matches(request):
+            return None
+        return Response(
+            status_code=304, headers={**self.headers, "Vary": "Accept-Encoding"}
+        )
+
+
+async def collection_validators(counters: Iterable[str], *key: Any) -> Validators:
+    """
+    Validators for a response derived from whole collections.
+
+    They change whenever one of the counters is bumped, or for a different
+    key, eg. the query parameters. The revision only changes with the
+    counters, response cache keys include it so entries cached before a
+    write by another process, eg. a task, are never served after it.
+    """
+    counters = sorted(counters)
+    documents = {
+        document['_id']: document
+        async for document in counter_collection.find({'_id': {'$in': counters}})
+    }
+    values = [documents.get(name, {}).get('value', 0) for name in counters]
+    digest = hashlib.sha1(orjson.dumps([values, key], default=str)).hexdigest()
+    revision = hashlib.sha1(orjson.dumps([counters, values])).hexdigest()
+    last_modified = max(
+        (d['modified_at'] for d in documents.values() if d.get('modified_at')),
+        default=None,
+    )
+    return Validators(f'"{digest[:20]}"', last_modified, revision[:20])
@@ -1,23 +1,99 @@
-import requests
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+import httpx
 
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+
+class MailgunTransport:
+    def __init__(
+        self,
+        mailgun_domain: str = settings.mailgun_domain,
+        mailgun_api_key: str = settings.mailgun_api_key,
+    ):
+        self.url = f"https://api.eu.mailgun.net/v3/{mailgun_domain}/messages"
+        self.mailgun_api_key = mailgun_api_key
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def send(self, message: dict):
+        if self.client is None:
+            # One pooled client per process, connections are reused across emails
+            self.client = httpx.AsyncClient(timeout=settings.email_timeout_seconds)
+        response = await self.client.post(
+            self.url, auth=("api", self.mailgun_api_key), data=message
+        )
+        response.raise_for_status()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+class FakeTransport:
+    """Keeps messages in memory instead of sending them, for tests and local use."""
+
+    def __init__(self):
+        self.outbox: List[dict] = []
+
+    async def send(self, message: dict):
+        self.outbox.append(message)
+
+    async def close(self):
+        pass
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
 
 class EmailService:
+    """
+    Queue of outgoing emails delivered by a fixed number of asyncio workers.
+
+    Delivery failures are retried with exponential backoff, and repeated
+    requests for the same address within the dedupe window are dropped.
+    """
+
     base_url: str = settings.base_url
-    mailgun_domain: str = settings.mailgun_domain
-    mailgun_api_key: str = settings.mailgun_api_key
     token_link: str = ""
 
-    def send_email_verification_link(self, email: str, token: str = ""):
-        req = requests.post(
-            f"https://api.eu.mailgun.net/v3/{self.mailgun_domain}/messages",
-            auth=("api", self.mailgun_api_key),
-            data={
-                "from": "ParkplatzTransform noreply@mg.xtransform.org",
-                "to": [email],
-                "subject": "Verifizierung deiner E-Mail-Adresse erforderlich",
-                "text": f"""
+    def __init__(
+        self,
+        transport=None,
+        concurrency: int = settings.email_concurrency,
+        max_retries: int = settings.email_max_retries,
+        retry_backoff_seconds: float = settings.email_retry_backoff_seconds,
+        dedupe_seconds: int = settings.email_dedupe_seconds,
+    ):
+        if transport is None:
+            transport = (
+                FakeTransport() if settings.email_transport == "fake"
+                else MailgunTransport()
+            )
+        self.transport = transport
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.dedupe_seconds = dedupe_seconds
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+        self.last_sent = {}
+
+    def verification_message(self, email: str, token: str = "") -> dict:
+        return {
+            "from": "ParkplatzTransform noreply@mg.xtransform.org",
+            "to": [email],
+            "subject": "Verifizierung deiner E-Mail-Adresse erforderlich",
+            "text": f"""
 Hallo lieber PTler,
 um dich einzuloggen, klicke bitte auf diesen Link:
 {self.base_url}/users/verify/?code={token}&email={email}
@@ -27,8 +103,59 @@ Viel Erfolg!
 PS: Entwickler klicken während der Entwicklung hier:
 http://localhost:3000/users/verify/?code={token}&email={email}&dev=true
                 """,
-            },
-        )
-        if req.status_code != 200:
-            return Exception(req.content)
-        return req
+        }
+
+    async def send_email_verification_link(self, email: str, token: str = "") -> bool:
+        """Queue a login link, returns False if one was queued for email recently."""
+        now = time.monotonic()
+        if now - self.last_sent.get(email, float("-inf")) < self.dedupe_seconds:
+            return False
+        self._forget_before(now - self.dedupe_seconds)
+        self.last_sent[email] = now
+
+        await self.start()
+        await self.queue.put(self.verification_message(email, token))
+        return True
+
+    def _forget_before(self, cutoff: float):
+        for email in [e for e, sent in self.last_sent.items() if sent < cutoff]:
+            del self.last_sent[email]
+
+    async def start(self):
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue()
+        self.workers = [
+            asyncio.create_task(self._work()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        """Deliver what is queued, then stop the workers."""
+        if self.queue is None:
+            return
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        await self.transport.close()
+        self.queue = None
+        self.workers = []
+
+    async def _work(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await self._deliver(message)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, message: dict):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.transport.send(message)
+                return
+            except Exception as e:
+                if attempt == self.max_retries or not _retryable(e):
+                    logger.exception(f"Could not send email to {message['to']}: {e}")
+                    return
+                await asyncio.sleep(self.retry_backoff_seconds * 2 ** attempt)
@@ -0,0 +1,94 @@
+import logging
+import time
+from typing import Dict, List
+
+from pymongo import ASCENDING, GEOSPHERE, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.config import settings
+from .database import db
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    'segments': [
+        IndexModel([('geometry', GEOSPHERE)], name='geometry_2dsphere'),
+        IndexModel(
+            [('properties.modified_at', ASCENDING), ('properties.owner_id', ASCENDING)],
+            name='modified_at_owner_id',
+        ),
+        # Keyset pagination with order_by=modified_at sorts on both
+        IndexModel(
+            [('properties.modified_at', ASCENDING), ('_id', ASCENDING)],
+            name='modified_at_id',
+        ),
+    ],
+    'deleted_segments': [
+        IndexModel(
+            [('deleted_at', ASCENDING)],
+            name='deleted_at_ttl',
+            expireAfterSeconds=settings.tombstone_ttl,
+        ),
+    ],
+    'users': [
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+    ],
+    'sessions': [
+        IndexModel(
+            [('created_at', ASCENDING)],
+            name='created_at_ttl',
+            expireAfterSeconds=settings.session_expiry,
+        ),
+    ],
+    'revoked_sessions': [
+        IndexModel(
+            [('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0
+        ),
+    ],
+    'clusters': [
+        IndexModel([('geometry', GEOSPHERE)], name='geometry_2dsphere'),
+    ],
+}
+
+
+async def ensure_indexes() -> Dict[str, List[str]]:
+    """
+    Create the registered indexes that do not exist yet.
+
+    Returns the names of the indexes that were missing per collection.
+    Failing builds, eg. a unique index over duplicate data, are logged
+    rather than raised so the API still starts.
+    """
+    missing = {}
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        for model in models:
+            options = model.document
+            if options['name'] in existing:
+                ttl = options.get('expireAfterSeconds')
+                if ttl != existing[options['name']].get('expireAfterSeconds'):
+                    await db.command(
+                        'collMod',
+                        collection_name,
+                        index={'name': options['name'], 'expireAfterSeconds': ttl},
+                    )
+                continue
+
+            missing.setdefault(collection_name, []).append(options['name'])
+            logger.warning(f"Missing index {collection_name}.{options['name']}")
+            started = time.monotonic()
+            try:
+                await collection.create_indexes([model])
+            except OperationFailure as e:
+                logger.error(
+                    f"Could not build index {collection_name}.{options['name']}: {e}"
+                )
+                continue
+            elapsed = time.monotonic() - started
+            if elapsed > settings.slow_index_build_seconds:
+                logger.warning(
+                    f"Building index {collection_name}.{options['name']} "
+                    f"took {elapsed:.1f}s"
+                )
+    return missing
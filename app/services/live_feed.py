@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from pymongo.errors import OperationFailure, PyMongoError
+from shapely.geometry import Polygon, shape
+from shapely.prepared import prep
+
+from app.config import settings
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    One live client: the area it watches and the events waiting to be sent.
+
+    Events are coalesced per segment, so a segment edited many times within
+    a batch interval is sent once, in its latest state.
+    """
+
+    def __init__(self, bbox: List[List[float]]):
+        self.set_bbox(bbox)
+        self.pending: Dict[str, dict] = {}
+        self.ready = asyncio.Event()
+
+    def set_bbox(self, bbox: List[List[float]]):
+        self.area = prep(Polygon(bbox))
+
+    def add(self, event: dict):
+        previous = self.pending.get(event['id'])
+        # The client never saw a segment created within this batch
+        if previous and previous['type'] == 'create' and event['type'] == 'update':
+            event = {**event, 'type': 'create'}
+        self.pending[event['id']] = event
+        self.ready.set()
+
+    async def next_batch(self, batch_seconds: float) -> List[dict]:
+        await self.ready.wait()
+        await asyncio.sleep(batch_seconds)
+        self.ready.clear()
+        batch, self.pending = list(self.pending.values()), {}
+        return batch
+
+
+class LiveFeed:
+    """
+    Fan out segment changes to subscriptions by area.
+
+    Changes come from Mongo change streams on the segment and tombstone
+    collections. Standalone servers have no change streams, there the
+    collections are polled on modified_at and deleted_at instead, reading
+    a look-back window again each time for writes stamped late.
+    The feed only runs while there are subscriptions.
+
+    The last known geometry of changed segments is kept, so subscriptions
+    a segment moved out of get a delete for it.
+    """
+
+    def __init__(
+        self,
+        collection,
+        deleted_collection,
+        poll_seconds: float = settings.live_poll_seconds,
+        poll_lookback_seconds: float = settings.poll_lookback_seconds,
+        batch_seconds: float = settings.live_batch_seconds,
+        geometry_cache_size: int = settings.live_geometry_cache_size,
+    ):
+        self.collection = collection
+        self.deleted_collection = deleted_collection
+        self.poll_seconds = poll_seconds
+        self.poll_lookback = timedelta(seconds=poll_lookback_seconds)
+        self.batch_seconds = batch_seconds
+        self.subscriptions: Set[Subscription] = set()
+        self.task: Optional[asyncio.Task] = None
+        self.geometries = LRUCache(geometry_cache_size)
+
+    def subscribe(self, bbox: List[List[float]]) -> Subscription:
+        subscription = Subscription(bbox)
+        self.subscriptions.add(subscription)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+        if not self.subscriptions:
+            await self.stop()
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    def publish(
+        self,
+        event: dict,
+        geometry: Optional[dict],
+        previous_geometry: Optional[dict] = None,
+    ):
+        area = shape(geometry) if geometry else None
+        previous_area = shape(previous_geometry) if previous_geometry else None
+        for subscription in self.subscriptions:
+            # Without a location a delete may concern anyone
+            if area is None or subscription.area.intersects(area):
+                subscription.add(event)
+            elif previous_area is not None and subscription.area.intersects(
+                previous_area
+            ):
+                # Moved out of the area, the client has to drop it
+                subscription.add({'type': 'delete', 'id': event['id']})
+
+    def remember(self, segment: Optional[dict]):
+        """Note the geometry a segment had before a write of this process."""
+        if not self.subscriptions or segment is None:
+            return
+        # The change may have been published already, keep its newer geometry
+        if segment['_id'] not in self.geometries:
+            self.geometries.set(segment['_id'], segment['geometry'])
+
+    def publish_document(self, document: dict, operation: str):
+        previous_geometry = self.geometries.pop(document['_id'])
+        if operation == 'delete':
+            event = {'type': 'delete', 'id': document['_id']}
+        else:
+            event = {
+                'type': operation,
+                'id': document['_id'],
+                'feature': {
+                    'id': document['_id'],
+                    'type': 'Feature',
+                    'geometry': document['geometry'],
+                    'properties': document['properties'],
+                },
+            }
+            self.geometries.set(document['_id'], document['geometry'])
+        self.publish(event, document.get('geometry'), previous_geometry)
+
+    async def _run(self):
+        watchers = [
+            asyncio.create_task(self._watch(self.collection, 'update')),
+            asyncio.create_task(self._watch(self.deleted_collection, 'delete')),
+        ]
+        try:
+            await asyncio.gather(*watchers)
+        except OperationFailure as e:
+            for watcher in watchers:
+                watcher.cancel()
+            await asyncio.gather(*watchers, return_exceptions=True)
+            logger.info(f"Change streams unavailable ({e}), polling for changes")
+            await self._poll()
+        finally:
+            for watcher in watchers:
+                watcher.cancel()
+
+    async def _watch(self, collection, operation: str):
+        operations = ['insert', 'replace', 'update']
+        pipeline = [{'$match': {'operationType': {'$in': operations}}}]
+        resume_token = None
+        while True:
+            try:
+                async with collection.watch(
+                    pipeline, full_document='updateLookup', resume_after=resume_token
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        document = change.get('fullDocument')
+                        if document is None:
+                            continue
+                        created = change['operationType'] == 'insert'
+                        if operation == 'update' and created:
+                            self.publish_document(document, 'create')
+                        else:
+                            self.publish_document(document, operation)
+            except OperationFailure:
+                if resume_token is None:
+                    raise
+                # The resume point may have left the oplog, start over from now
+                logger.exception("Live feed change stream failed, restarting")
+                resume_token = None
+                await asyncio.sleep(self.poll_seconds)
+            except PyMongoError:
+                logger.exception("Live feed change stream failed, resuming")
+                await asyncio.sleep(self.poll_seconds)
+
+    async def _poll(self):
+        modified = PollWindow(
+            'properties.modified_at',
+            lambda document: document['properties']['modified_at'],
+        )
+        deleted = PollWindow('deleted_at', lambda document: document['deleted_at'])
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                async for document in modified.changes(
+                    self.collection, self.poll_lookback
+                ):
+                    properties = document['properties']
+                    created = properties.get('created_at') == properties['modified_at']
+                    self.publish_document(document, 'create' if created else 'update')
+                async for document in deleted.changes(
+                    self.deleted_collection, self.poll_lookback
+                ):
+                    self.publish_document(document, 'delete')
+            except PyMongoError:
+                logger.exception("Live feed polling failed")
+
+
+class PollWindow:
+    """
+    Documents of a collection changed since the last poll, by a timestamp.
+
+    Each poll reads from lookback before the latest timestamp seen, so a
+    write stamped earlier than one already read is still found. Documents
+    already returned with the same timestamp are skipped.
+    """
+
+    def __init__(
+        self,
+        field: str,
+        timestamp: Callable[[dict], datetime],
+        latest: Optional[datetime] = None,
+    ):
+        self.field = field
+        self.timestamp = timestamp
+        self.latest = latest or datetime.now()
+        # id -> timestamp of the documents returned within the window
+        self.seen: Dict[Any, datetime] = {}
+
+    async def changes(self, collection, lookback: timedelta):
+        since = self.latest - lookback
+        self.seen = {id_: at for id_, at in self.seen.items() if at >= since}
+        async for document in collection.find(
+            {self.field: {'$gte': since}}
+        ).sort(self.field, 1):
+            at = self.timestamp(document)
+            if self.seen.get(document['_id']) == at:
+                continue
+            self.seen[document['_id']] = at
+            self.latest = max(self.latest, at)
+            yield document
@@ -0,0 +1,130 @@
+import math
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from app.config import settings
+from app.strings import validation
+from .cache import LRUCache
+from .redis import get_redis
+
+periods = {"second": 1, "minute": 60, "hour": 60 * 60, "day": 24 * 60 * 60}
+
+
+def parse_limit(limit: str) -> Tuple[int, float]:
+    """'5/minute' -> bucket capacity 5, refilled at 5 tokens per 60 seconds."""
+    count, period = limit.split("/")
+    return int(count), int(count) / periods[period.strip()]
+
+
+class MemoryBucketBackend:
+    def __init__(self, maxsize: int = settings.rate_limit_max_keys):
+        self.buckets = LRUCache(maxsize)
+
+    async def take(self, key: str, capacity: int, rate: float) -> float:
+        """Take a token, returns 0 or the seconds until one is available."""
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        retry_after = 0 if tokens >= 1 else (1 - tokens) / rate
+        if tokens >= 1:
+            tokens -= 1
+        self.buckets.set(key, (tokens, now))
+        return retry_after
+
+
+class RedisBucketBackend:
+    prefix = "rate-limit:"
+    # Refill and take atomically, so all workers share one bucket per key
+    script = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated_at) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(retry_after)
+"""
+
+    def __init__(self):
+        self.redis = get_redis()
+        self.take_script = self.redis.register_script(self.script)
+
+    async def take(self, key: str, capacity: int, rate: float) -> float:
+        retry_after = await self.take_script(
+            keys=[self.prefix + key], args=[capacity, rate, time.time()]
+        )
+        return float(retry_after)
+
+
+def _create_backend():
+    if settings.rate_limit_backend == "redis":
+        return RedisBucketBackend()
+    return MemoryBucketBackend()
+
+
+rate_limit_backend = _create_backend()
+
+
+async def client_ip(request: Request) -> Optional[str]:
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    if settings.trust_forwarded_for and forwarded_for:
+        # The right-most address is the one added by our own proxy
+        return forwarded_for.split(",")[-1].strip()
+    return request.client.host if request.client else None
+
+
+def body_field(field: str) -> Callable[[Request], Awaitable[Optional[str]]]:
+    async def key(request: Request) -> Optional[str]:
+        try:
+            value = (await request.json()).get(field)
+        except (ValueError, AttributeError):
+            return None
+        return str(value).strip().lower() if value else None
+
+    return key
+
+
+class RateLimit:
+    """
+    Token bucket rate limit, used as a route dependency.
+
+    Requests are bucketed by whatever the key function returns for them,
+    eg. the client IP, and get a 429 with a Retry-After header once their
+    bucket is empty.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: str,
+        key: Callable[[Request], Awaitable[Optional[str]]] = client_ip,
+        backend=None,
+    ):
+        self.name = name
+        self.capacity, self.rate = parse_limit(limit)
+        self.key = key
+        self.backend = backend
+
+    async def __call__(self, request: Request):
+        key = await self.key(request)
+        if key is None:
+            return
+        backend = self.backend or rate_limit_backend
+        retry_after = await backend.take(f"{self.name}:{key}", self.capacity, self.rate)
+        if retry_after > 0:
+            raise HTTPException(
+                429,
+                validation["rate_limit"],
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
@@ -0,0 +1,13 @@
+from app.config import settings
+
+_client = None
+
+
+def get_redis():
+    """Shared asyncio Redis client, only imported when a Redis backend is used."""
+    global _client
+    if _client is None:
+        import redis.asyncio
+
+        _client = redis.asyncio.from_url(settings.redis_url)
+    return _client
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from pymongo.errors import PyMongoError
+from shapely.geometry import Polygon
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.geo import SpatialIndex
+from .live_feed import PollWindow
+
+logger = logging.getLogger(__name__)
+
+
+def summarize(segment: dict) -> dict:
+    """The feature query_segments sends without details."""
+    properties = segment['properties']
+    return {
+        **segment,
+        'id': segment['_id'],
+        'properties': {
+            **properties,
+            'has_subsegments': bool(properties.get('subsegments')),
+            'subsegments': [],
+        },
+    }
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Mongo hands out naive datetimes, compare client supplied ones the same way
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class SegmentReplica:
+    """
+    In-process read model of the segments, answering bbox queries from RAM.
+
+    It is loaded once, kept current by the write hooks of this process and
+    reconciled periodically on modified_at and deleted_at, to pick up
+    writes made by other processes. Each reconcile reads a look-back window
+    again, for writes stamped late by a slower clock.
+    """
+
+    def __init__(
+        self,
+        collection,
+        deleted_collection,
+        reconcile_seconds: float = settings.segment_replica_reconcile_seconds,
+        rebuild_threshold: int = settings.segment_replica_rebuild_threshold,
+        lookback_seconds: float = settings.poll_lookback_seconds,
+    ):
+        self.collection = collection
+        self.deleted_collection = deleted_collection
+        self.reconcile_seconds = reconcile_seconds
+        self.lookback = timedelta(seconds=lookback_seconds)
+        self.index = SpatialIndex(rebuild_threshold)
+        self.ready = False
+        self.modified: Optional[PollWindow] = None
+        self.deleted: Optional[PollWindow] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        # Writes the load misses are stamped about this late or later
+        loaded_at = datetime.now()
+        self.modified = PollWindow(
+            'properties.modified_at',
+            lambda segment: segment['properties']['modified_at'],
+            loaded_at,
+        )
+        self.deleted = PollWindow(
+            'deleted_at', lambda tombstone: tombstone['deleted_at'], loaded_at
+        )
+        segments = [segment async for segment in self.collection.find()]
+        await run_in_threadpool(
+            self.index.build,
+            (
+                (segment['_id'], segment['geometry'], summarize(segment))
+                for segment in segments
+            ),
+        )
+        self.ready = True
+        logger.info(f"Loaded {len(self.index)} segments into the replica")
+
+    async def start(self):
+        await self.load()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    def apply(self, changes: Iterable[Tuple[Optional[dict], Optional[dict]]]):
+        if not self.ready:
+            return
+        for old, new in changes:
+            if new is None:
+                self.index.remove(old['_id'])
+            else:
+                self.index.add(new['_id'], new['geometry'], summarize(new))
+
+    async def reconcile(self):
+        """Catch up with writes of other processes."""
+        async for tombstone in self.deleted.changes(
+            self.deleted_collection, self.lookback
+        ):
+            self.index.remove(tombstone['_id'])
+        async for segment in self.modified.changes(self.collection, self.lookback):
+            self.index.add(segment['_id'], segment['geometry'], summarize(segment))
+
+    def query(
+        self,
+        bbox: List[List[float]],
+        exclude_ids: List[str] = [],
+        include_if_modified_after: Optional[datetime] = None,
+    ) -> List[dict]:
+        features = self.index.query(Polygon(bbox))
+        if exclude_ids:
+            held = set(exclude_ids)
+            features = [feature for feature in features if feature['_id'] not in held]
+            modified_after = _naive_utc(include_if_modified_after)
+            if modified_after is not None:
+                # Changed held segments are sent wherever they are now, so the
+                # client also moves those that left the bbox
+                for feature in map(self.index.get, held):
+                    modified_at = feature and feature['properties'].get('modified_at')
+                    if modified_at is not None and modified_at > modified_after:
+                        features.append(feature)
+        # Callers may simplify the geometry in place
+        return [
+            {**feature, 'geometry': {**feature['geometry']}} for feature in features
+        ]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reconcile_seconds)
+            try:
+                await self.reconcile()
+            except PyMongoError:
+                logger.exception("Could not reconcile the segment replica")
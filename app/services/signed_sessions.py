@@ -0,0 +1,127 @@
+import asyncio
+import time
+from typing import Optional
+from uuid import uuid4
+
+import jwt
+
+from app.config import settings
+
+
+class SessionSigner:
+    """Stateless sessions: the cookie itself is a signed token with the user."""
+
+    JWT_ALGORITHM = settings.jwt_algorithm
+    ENCODING = "utf8"
+    # Tells session tokens apart from other tokens signed with the secret key
+    AUDIENCE = "session"
+
+    def __init__(
+        self,
+        secret_key: str = settings.secret_key,
+        session_expiry: int = settings.session_expiry,
+    ):
+        self.secret_key = secret_key
+        self.session_expiry = session_expiry
+
+    def issue(self, user: dict) -> str:
+        now = time.time()
+        return jwt.encode(
+            {
+                "sub": user["id"],
+                "aud": self.AUDIENCE,
+                "email": user["email"],
+                "permission_level": user["permission_level"],
+                "jti": str(uuid4()),
+                "iat": now,
+                "exp": int(now) + self.session_expiry,
+            },
+            self.secret_key,
+            algorithm=self.JWT_ALGORITHM,
+        ).decode(self.ENCODING)
+
+    def verify(self, token: str) -> Optional[dict]:
+        try:
+            return jwt.decode(
+                token,
+                self.secret_key,
+                algorithms=[self.JWT_ALGORITHM],
+                audience=self.AUDIENCE,
+            )
+        except jwt.InvalidTokenError:
+            return None
+
+
+class RevocationList:
+    """
+    Process local copy of the revoked signed sessions.
+
+    Holds revoked token ids and, per user, a time before which all of
+    their tokens are revoked. The copy is reloaded from the collection at
+    most every refresh_seconds, entries are removed by a TTL index once
+    the tokens they revoke have expired anyway.
+    """
+
+    def __init__(
+        self, collection, refresh_seconds: int = settings.revocation_refresh_seconds
+    ):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self.token_ids = set()
+        self.users = {}
+        self.refreshed_at = None
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self.refreshed_at is not None and (
+            time.monotonic() - self.refreshed_at < self.refresh_seconds
+        )
+
+    async def refresh(self, force: bool = False):
+        if not force and self._fresh():
+            return
+        refresh_requested_at = time.monotonic()
+        async with self._lock:
+            # Requests queued on the lock reuse the reload that held it
+            if self.refreshed_at is not None and (
+                self.refreshed_at >= refresh_requested_at
+                or (not force and self._fresh())
+            ):
+                return
+            started_at = time.monotonic()
+            token_ids = set()
+            users = {}
+            async for revocation in self.collection.find():
+                if "user_id" in revocation:
+                    users[revocation["user_id"]] = revocation["revoked_before"]
+                else:
+                    token_ids.add(revocation["_id"])
+            self.token_ids, self.users = token_ids, users
+            self.refreshed_at = started_at
+
+    def is_revoked(self, claims: dict) -> bool:
+        return claims["jti"] in self.token_ids or (
+            claims["iat"] <= self.users.get(claims["sub"], float("-inf"))
+        )
+
+    async def revoke_token(self, claims: dict, expires_at):
+        self.token_ids.add(claims["jti"])
+        await self.collection.replace_one(
+            {"_id": claims["jti"]},
+            {"_id": claims["jti"], "expires_at": expires_at},
+            upsert=True,
+        )
+
+    async def revoke_user(self, user_id: str, expires_at):
+        revoked_before = time.time()
+        self.users[user_id] = revoked_before
+        await self.collection.replace_one(
+            {"_id": f"user:{user_id}"},
+            {
+                "_id": f"user:{user_id}",
+                "user_id": user_id,
+                "revoked_before": revoked_before,
+                "expires_at": expires_at,
+            },
+            upsert=True,
+        )
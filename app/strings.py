@@ -5,4 +5,16 @@ validation = {
     "permission": "User does not have appropriate permissions",
     "user_not_found": "User not found",
     "bbox": "Bounding box must contain a valid polygon, eg. bbox=XX,XX,XX,XX,XX",
+    "segment_not_found": "Segment not found",
+    "subsegment_not_found": "Subsegment not found",
+    "subsegment_ambiguous": "Several subsegments share this order number",
+    "patch_path": "Unsupported patch operation or path",
+    "patch_conflict": "Patch operations conflict with each other",
+    "version_conflict": "Segment was changed in the meantime, reload it and try again",
+    "rate_limit": "Too many requests, please try again later",
+    "bulk": "Body must be a GeoJSON FeatureCollection or newline delimited features",
+    "bulk_duplicate_id": "Feature id appears more than once in the request",
+    "cursor": "Invalid pagination cursor",
+    "tile": "Tile coordinates must be a valid z/x/y, eg. 15/17606/10742",
+    "tile_zoom": "Tile zoom level is too low, request tiles of a higher zoom",
 }
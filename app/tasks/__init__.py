@@ -1 +1,5 @@
 from .count_clusters import count_clusters  # noqa
+from .load_clusters import load_clusters  # noqa
+from .export_parquet import export_parquet  # noqa
+from .backfill_derived_fields import backfill_derived_fields  # noqa
+from .set_permission_level import set_permission_level  # noqa
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List
+
+from pymongo import UpdateOne
+from starlette.concurrency import run_in_threadpool
+
+from app.controllers.derived import derive_fields, derived_field_updates
+from app.controllers.segments import segment_collection
+from app.services import bump_counter, response_cache
+from .count_clusters import count_clusters
+
+
+def _derived_values(segment: dict) -> list:
+    properties = segment['properties']
+    return [
+        segment.get('bbox'),
+        properties.get('length_in_meters'),
+        [s.get('estimated_car_count') for s in properties.get('subsegments') or []],
+    ]
+
+
+async def _backfill(segments: List[dict]) -> int:
+    stored = [_derived_values(segment) for segment in segments]
+    await run_in_threadpool(derive_fields, segments)
+    # Only rewrite what changed, every rewrite is a new version of the segment
+    changed = [
+        segment for segment, values in zip(segments, stored)
+        if _derived_values(segment) != values
+    ]
+    if not changed:
+        return 0
+    result = await segment_collection.bulk_write([
+        # Skip segments edited meanwhile, their write derived the fields.
+        # Bumping the version changes the ETag of the rewritten segments,
+        # modified_at lets replicas and incremental syncs pick them up.
+        UpdateOne(
+            {
+                '_id': segment['_id'],
+                'properties.modified_at': segment['properties'].get('modified_at'),
+            },
+            {
+                '$set': {
+                    **derived_field_updates(segment),
+                    'properties.modified_at': datetime.now(),
+                },
+                '$inc': {'properties.version': 1},
+            },
+        )
+        for segment in changed
+    ], ordered=False)
+    return result.modified_count
+
+
+async def backfill_derived_fields(batch_size: int = 1000):
+    """
+    Recompute bbox, length_in_meters and estimated_car_count of all segments.
+
+    The estimates count towards the cluster totals, so these are recounted
+    afterwards.
+    """
+    modified = 0
+    segments = []
+    async for segment in segment_collection.find(
+        {},
+        {
+            'geometry': 1,
+            'bbox': 1,
+            'properties.length_in_meters': 1,
+            'properties.subsegments': 1,
+            'properties.modified_at': 1,
+        },
+    ).batch_size(batch_size):
+        segments.append(segment)
+        if len(segments) == batch_size:
+            modified += await _backfill(segments)
+            segments = []
+    if segments:
+        modified += await _backfill(segments)
+    logging.info(f"Updated derived fields of {modified} segments")
+
+    await response_cache.clear()
+    await bump_counter('segments')
+    await count_clusters(batch_size)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(backfill_derived_fields())
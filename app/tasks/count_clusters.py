@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+import shapely
+from pymongo import UpdateOne
+from shapely.geometry import shape
+
+from app.controllers.clusters import (
+    cluster_collection,
+    cluster_stats_collection,
+    segment_stats,
+)
+from app.controllers.segments import segment_collection
+from app.geo import first_coordinate
+from app.services import bump_counter, response_cache
+
+
+async def count_clusters(batch_size: int = 1000):
+    """
+    Reassign every segment to its cluster and rebuild cluster_stats.
+
+    Segment writes keep the stats up to date incrementally, this is for
+    the initial import and for repairing drift. Writes made while it runs
+    may be lost from the totals, so run it when editing is quiet.
+    """
+    cluster_ids = []
+    polygons = []
+    async for cluster in cluster_collection.find({}, {'geometry': 1}):
+        cluster_ids.append(cluster['_id'])
+        polygons.append(shape(cluster['geometry']))
+    tree = shapely.STRtree(polygons)
+
+    totals = defaultdict(lambda: defaultdict(int))
+    updates = []
+    reassigned = 0
+    async for segment in segment_collection.find(
+        {}, {'geometry': 1, 'properties.subsegments': 1, 'properties.cluster_id': 1}
+    ):
+        point = shapely.Point(first_coordinate(segment['geometry']))
+        hits = tree.query(point, predicate='intersects')
+        cluster_id = cluster_ids[hits.min()] if len(hits) else None
+        if cluster_id != segment['properties'].get('cluster_id'):
+            reassigned += 1
+            updates.append(UpdateOne(
+                {'_id': segment['_id']},
+                # A new version, so ETags of the segment change, and a new
+                # modified_at, so replicas and incremental syncs pick it up
+                {
+                    '$set': {
+                        'properties.cluster_id': cluster_id,
+                        'properties.modified_at': datetime.now(),
+                    },
+                    '$inc': {'properties.version': 1},
+                },
+            ))
+        if len(updates) >= batch_size:
+            await segment_collection.bulk_write(updates, ordered=False)
+            updates = []
+        if cluster_id is not None:
+            for field, value in segment_stats(segment).items():
+                totals[cluster_id][field] += value
+    if updates:
+        await segment_collection.bulk_write(updates, ordered=False)
+
+    await cluster_stats_collection.delete_many({})
+    if totals:
+        await cluster_stats_collection.bulk_write([
+            UpdateOne({'_id': cluster_id}, {'$set': fields}, upsert=True)
+            for cluster_id, fields in totals.items()
+        ])
+    # Only now, so no validator or cached response predates the new stats
+    if reassigned:
+        await response_cache.clear()
+        await bump_counter('segments')
+    else:
+        await response_cache.invalidate(['clusters'])
+    await bump_counter('clusters')
+    logging.info(
+        f"Counted segments of {len(totals)} clusters, reassigned {reassigned}"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(count_clusters())
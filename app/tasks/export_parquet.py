@@ -0,0 +1,28 @@
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+from app import schemas
+from app.controllers import write_parquet
+
+
+async def export_parquet(directory: Path = Path(".")):
+    """Write segments.parquet and subsegments.parquet into directory."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = {
+        table: directory / f"{table.value}.parquet" for table in schemas.ExportTable
+    }
+    files = {table: path.open("wb") for table, path in paths.items()}
+    try:
+        await write_parquet(files)
+    finally:
+        for file in files.values():
+            file.close()
+    for path in paths.values():
+        logging.info(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(export_parquet(Path(sys.argv[1]) if len(sys.argv) > 1 else Path(".")))
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+from pathlib import Path
+
+import orjson
+from pymongo import GEOSPHERE, ReplaceOne
+from shapely.geometry import mapping, shape
+
+from app.config import settings
+from app.controllers.clusters import cluster_collection
+from app.services import bump_counter, response_cache
+from .count_clusters import count_clusters
+
+ORTSTEILE_PATH = Path(__file__).parent / 'berlin_ortsteile.geojson'
+
+
+def cluster_document(feature: dict) -> dict:
+    """Cluster with its display geometry, centroid and bbox precomputed."""
+    polygon = shape(feature['geometry'])
+    display_geometry = polygon.simplify(
+        settings.cluster_simplify_tolerance, preserve_topology=True
+    )
+    return {
+        '_id': str(feature['properties']['cartodb_id']),
+        'type': 'Feature',
+        'name': feature['properties']['name'],
+        'geometry': feature['geometry'],
+        'display_geometry': mapping(display_geometry),
+        'centroid': mapping(polygon.centroid),
+        'bbox': list(polygon.bounds),
+    }
+
+
+async def load_clusters(path: Path = ORTSTEILE_PATH):
+    """Import district polygons into the clusters collection and recount them."""
+    features = orjson.loads(path.read_bytes())['features']
+    documents = [cluster_document(feature) for feature in features]
+
+    await cluster_collection.bulk_write([
+        ReplaceOne({'_id': document['_id']}, document, upsert=True)
+        for document in documents
+    ])
+    await cluster_collection.delete_many(
+        {'_id': {'$nin': [document['_id'] for document in documents]}}
+    )
+    await cluster_collection.create_index([('geometry', GEOSPHERE)])
+    await response_cache.invalidate(['clusters'])
+    await bump_counter('clusters')
+    logging.info(f"Loaded {len(documents)} clusters from {path.name}")
+
+    await count_clusters()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(load_clusters())
@@ -0,0 +1,25 @@
+import asyncio
+import logging
+import sys
+
+from app.controllers import get_user_by_email, update_user_permission
+from app.permissions import access_levels
+
+
+async def set_permission_level(email: str, level: str):
+    """Grant the user with this email one of the access_levels, eg. contributor."""
+    user = await get_user_by_email(email)
+    if user is None:
+        raise SystemExit(f"No user with email {email}")
+    await update_user_permission(user['id'], access_levels[level])
+    logging.info(f"Set permission level of {email} to {level}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 3 or sys.argv[2] not in access_levels:
+        raise SystemExit(
+            f"Usage: python -m app.tasks.set_permission_level <email> "
+            f"<{'|'.join(access_levels)}>"
+        )
+    asyncio.run(set_permission_level(sys.argv[1], sys.argv[2]))
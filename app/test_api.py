@@ -1,4 +1,7 @@
+import io
 import uuid
+import orjson
+import pyarrow.parquet as pq
 import pytest
 from unittest.mock import patch
 
@@ -8,7 +11,8 @@ import asyncio
 
 from app.main import app
 from app.routers.users import get_session
-from app.services import OneTimeAuth
+from app.services import OneTimeAuth, ensure_indexes
+from app.tasks import count_clusters, load_clusters
 
 
 client = TestClient(app)
@@ -61,6 +65,12 @@ async def test_docs():
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_ensure_indexes():
+    await ensure_indexes()
+    assert await ensure_indexes() == {}
+
+
 @pytest.mark.asyncio
 async def test_create_user():
     with patch.object(uuid, "uuid4", side_effect=lambda: user_id):
@@ -171,18 +181,92 @@ async def test_read_segments_with_options():
         assert len(response.json()["features"]) == 2
 
 
+@pytest.mark.asyncio
+async def test_read_segments_ndjson():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/segments/?format=ndjson")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert len(response.text.splitlines()) == 2
+
+
+@pytest.mark.asyncio
+async def test_read_segments_paginated():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await ac.get("/segments/?limit=1&order_by=modified_at")
+        second = await ac.get(
+            "/segments/",
+            params={"cursor": first.json()["next_cursor"], "order_by": "modified_at"},
+        )
+        invalid = await ac.get("/segments/?cursor=invalid")
+    assert len(first.json()["features"]) == 1
+    assert len(second.json()["features"]) == 1
+    assert first.json()["features"][0]["_id"] != second.json()["features"][0]["_id"]
+    assert second.json()["next_cursor"] is None
+    assert invalid.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_export_segments_parquet():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        segments = await ac.get("/segments/export/segments.parquet")
+        subsegments = await ac.get("/segments/export/subsegments.parquet")
+    assert segments.status_code == 200
+    assert pq.read_table(io.BytesIO(segments.content)).num_rows == 2
+    assert "segment_id" in pq.read_table(io.BytesIO(subsegments.content)).column_names
+
+
 @pytest.mark.asyncio
 async def test_read_segment():
     async with AsyncClient(app=app, base_url="http://test") as ac:
         response = await ac.get(f"/segments/{pytest.segment_id}/")
     assert response.status_code == 200
     assert response.json()["id"] == pytest.segment_id
+    assert len(response.json()["bbox"]) == 4
+    assert round(response.json()["properties"]["length_in_meters"]) == 145
     assert response.json()["geometry"]["coordinates"] == [
         [13.43244105577469, 52.54816979768233],
         [13.43432933092117, 52.54754673757979],
     ]
 
 
+@pytest.mark.asyncio
+async def test_read_segment_not_modified():
+    query = {
+        "bbox": [
+            [13.4, 52.5],
+            [13.5, 52.5],
+            [13.5, 52.6],
+            [13.4, 52.6],
+            [13.4, 52.5],
+        ],
+        "details": True,
+    }
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        segment = await ac.get(f"/segments/{pytest.segment_id}/")
+        cached_segment = await ac.get(
+            f"/segments/{pytest.segment_id}/",
+            headers={"If-None-Match": segment.headers["etag"]},
+        )
+        segments = await ac.post("/query-segments/", json=query)
+        cached_segments = await ac.post(
+            "/query-segments/",
+            json=query,
+            headers={"If-None-Match": segments.headers["etag"]},
+        )
+        other_segments = await ac.post(
+            "/query-segments/",
+            json={**query, "details": False},
+            headers={"If-None-Match": segments.headers["etag"]},
+        )
+    assert segment.headers["etag"] == '"1"'
+    assert "last-modified" in segment.headers
+    assert cached_segment.status_code == 304
+    assert cached_segment.content == b""
+    assert cached_segments.status_code == 304
+    assert other_segments.status_code == 200
+
+
 @pytest.mark.asyncio
 async def test_update_segment():
     data = {
@@ -260,6 +344,146 @@ async def test_update_segment():
     ]
 
 
+@pytest.mark.asyncio
+async def test_update_segment_version_conflict():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        segment = (await ac.get(f"/segments/{pytest.segment_id}/")).json()
+        stale = await ac.put(
+            f"/segments/{pytest.segment_id}/",
+            json=segment,
+            headers={"If-Match": '"1"'},
+        )
+        current = await ac.put(f"/segments/{pytest.segment_id}/", json=segment)
+    assert segment["properties"]["version"] == 2
+    assert stale.status_code == 412
+    assert current.status_code == 200
+    assert current.headers["etag"] == '"3"'
+
+
+@pytest.mark.asyncio
+async def test_patch_segment():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        # Both subsegments still have order number 0
+        ambiguous = await ac.patch(
+            f"/segments/{pytest.segment_id}/subsegments/0",
+            json={"car_count": 4},
+            headers={"If-Match": '"3"'},
+        )
+        segment = (await ac.get(f"/segments/{pytest.segment_id}/")).json()
+        subsegments = segment["properties"]["subsegments"]
+        subsegments[0]["car_count"] = 4
+        subsegments[1]["order_number"] = 1
+        patched = await ac.patch(
+            f"/segments/{pytest.segment_id}/",
+            json=[
+                {
+                    "op": "replace",
+                    "path": "/properties/further_comments",
+                    "value": "patched",
+                },
+                {
+                    "op": "replace",
+                    "path": "/properties/subsegments",
+                    "value": subsegments,
+                },
+            ],
+            headers={"If-Match": '"3"'},
+        )
+        subsegment = await ac.patch(
+            f"/segments/{pytest.segment_id}/subsegments/1",
+            json={"car_count": 4},
+        )
+        stale = await ac.patch(
+            f"/segments/{pytest.segment_id}/subsegments/0",
+            json={"car_count": 5},
+            headers={"If-Match": '"3"'},
+        )
+        missing = await ac.patch(
+            f"/segments/{pytest.segment_id}/subsegments/7",
+            json={"car_count": 5},
+        )
+        protected = await ac.patch(
+            f"/segments/{pytest.segment_id}/",
+            json=[{"op": "replace", "path": "/properties/owner_id", "value": "x"}],
+        )
+    assert ambiguous.status_code == 409
+    assert patched.json()["properties"]["further_comments"] == "patched"
+    assert patched.headers["etag"] == '"4"'
+    assert subsegment.status_code == 200
+    assert subsegment.headers["etag"] == '"5"'
+    subsegments = subsegment.json()["properties"]["subsegments"]
+    assert [s["car_count"] for s in subsegments] == [4, 4]
+    assert stale.status_code == 412
+    assert missing.status_code == 404
+    assert protected.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_query_segments_details():
+    query = {
+        "bbox": [
+            [13.4, 52.5],
+            [13.5, 52.5],
+            [13.5, 52.6],
+            [13.4, 52.6],
+            [13.4, 52.5],
+        ],
+        "details": False,
+    }
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        summary = await ac.post("/query-segments/", json=query)
+        detailed = await ac.post("/query-segments/", json={**query, "details": True})
+    segment = next(
+        f for f in summary.json()["features"] if f["id"] == pytest.segment_id
+    )
+    assert segment["properties"]["has_subsegments"]
+    assert segment["properties"]["subsegments"] == []
+    segment = next(
+        f for f in detailed.json()["features"] if f["id"] == pytest.segment_id
+    )
+    assert len(segment["properties"]["subsegments"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_statistics():
+    area = {
+        "type": "Polygon",
+        "coordinates": [[
+            [13.43, 52.54],
+            [13.44, 52.54],
+            [13.44, 52.55],
+            [13.43, 52.55],
+            [13.43, 52.54],
+        ]],
+    }
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post("/statistics/", json={"geometry": area})
+        point = {"type": "Point", "coordinates": [13, 52]}
+        invalid = await ac.post("/statistics/", json={"geometry": point})
+    statistics = response.json()
+    assert response.status_code == 200
+    assert statistics["segment_count"] == 1
+    assert statistics["parking_allowed"]["allowed"]["car_count"] == 4
+    assert statistics["street_location"]["street"]["subsegment_count"] == 1
+    assert statistics["fee"]["false"]["car_count"] == 4
+    no_parking = statistics["no_parking_reasons"]["private_parking"]
+    assert no_parking["subsegment_count"] == 1
+    assert invalid.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_read_segment_tile():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/segments/tiles/15/17606/10742.mvt")
+        invalid = await ac.get("/segments/tiles/1/5/5.mvt")
+        world = await ac.get("/segments/tiles/0/0/0.mvt")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+    assert len(response.content) > 0
+    assert invalid.status_code == 400
+    assert world.status_code == 400
+
+
 @pytest.mark.asyncio
 async def test_delete_segment():
     async with AsyncClient(app=app, base_url="http://test") as ac:
@@ -267,8 +491,86 @@ async def test_delete_segment():
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_query_segments_incremental():
+    query = {
+        "bbox": [
+            [13.4, 52.5],
+            [13.5, 52.5],
+            [13.5, 52.6],
+            [13.4, 52.6],
+            [13.4, 52.5],
+        ],
+        "details": False,
+    }
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post("/query-segments/", json=query)
+        held_ids = [feature["id"] for feature in response.json()["features"]]
+        response = await ac.post(
+            "/query-segments/",
+            json={**query, "exclude_ids": held_ids + [pytest.segment_id]},
+        )
+    assert response.status_code == 200
+    assert response.json()["features"] == []
+    assert response.json()["deleted_ids"] == [pytest.segment_id]
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_segments():
+    feature = {
+        "type": "Feature",
+        "properties": {"subsegments": []},
+        "geometry": {
+            "coordinates": [
+                [13.43244105577469, 52.54816979768233],
+                [13.43432933092117, 52.54754673757979],
+            ],
+            "type": "LineString",
+        },
+    }
+    body = b"\n".join([
+        orjson.dumps(feature),
+        orjson.dumps({"type": "Feature", "properties": {}}),
+    ])
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/segments/bulk/",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        created_id = response.json()["results"][0]["id"]
+        updated = await ac.post(
+            "/segments/bulk/",
+            json={"type": "FeatureCollection", "features": [
+                {**feature, "id": created_id},
+                {**feature, "id": created_id},
+            ]},
+        )
+    assert response.status_code == 200
+    assert response.json()["created"] == 1
+    assert response.json()["errors"] == 1
+    assert response.json()["results"][1]["status"] == "error"
+    assert updated.json()["results"][0] == {
+        "index": 0, "id": created_id, "status": "updated"
+    }
+    assert updated.json()["results"][1]["status"] == "error"
+    assert updated.json()["updated"] == 1
+
+
 @pytest.mark.asyncio
 async def test_clusters():
+    await load_clusters()
     async with AsyncClient(app=app, base_url="http://test") as ac:
         response = await ac.get("/clusters/")
+        full = await ac.get("/clusters/?full_geometry=true")
+        await count_clusters()
+        recounted = await ac.get(
+            "/clusters/", headers={"If-None-Match": response.headers["etag"]}
+        )
     assert response.status_code == 200
+    assert recounted.status_code == 200
+    assert len(response.json()["features"]) == 97
+    assert len(response.content) < len(full.content)
+    properties = response.json()["features"][0]["properties"]
+    assert properties["name"]
+    assert len(properties["centroid"]) == 2
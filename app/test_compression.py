@@ -0,0 +1,73 @@
+import orjson
+import pytest
+
+from app.services.cache import MemoryCacheBackend, ResponseCache
+from app.services.compression import decompress, negotiate
+
+
+def test_negotiate():
+    assert negotiate(None) == "identity"
+    assert negotiate("gzip, deflate, br") == "br"
+    assert negotiate("gzip;q=1, br;q=0.5") == "gzip"
+    assert negotiate("br;q=0, *") == "zstd"
+    assert negotiate("*;q=0") == "identity"
+
+
+@pytest.mark.asyncio
+async def test_response_cache_compresses_each_encoding_once():
+    cache = ResponseCache(MemoryCacheBackend())
+    builds = []
+
+    async def build():
+        builds.append(1)
+        return {"features": list(range(100))}
+
+    for encoding in ["br", "gzip", "zstd", "identity", "gzip"]:
+        payload = await cache.get_or_set("key", ["tag"], build, encoding=encoding)
+        assert orjson.loads(decompress(payload, encoding))["features"][-1] == 99
+    assert len(builds) == 1
+
+    await cache.invalidate(["tag"])
+    await cache.get_or_set("key", ["tag"], build, encoding="gzip")
+    assert len(builds) == 2
+
+
+@pytest.mark.asyncio
+async def test_response_cache_skips_payloads_built_before_a_write():
+    cache = ResponseCache(MemoryCacheBackend())
+    writes = []
+
+    async def build():
+        # A write lands while the read is still building
+        await cache.invalidate(["tile"])
+        writes.append(1)
+        return {"version": len(writes)}
+
+    await cache.get_or_set("key", ["tile"], build)
+    assert await cache.backend.get("key") is None
+    # Writes elsewhere do not keep a payload from being cached
+    await cache.get_or_set("other", ["other tile"], build)
+    assert await cache.backend.get("other") is not None
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_backend_forgets_evicted_keys():
+    backend = MemoryCacheBackend(maxsize=2)
+    for key in ["a", "b", "c"]:
+        await backend.set(key, b"value", ["tag", f"tag {key}"], 60)
+    assert backend.tags["tag"] == {"b", "c"}
+    assert "tag a" not in backend.tags
+    await backend.invalidate_tags(["tag b"])
+    assert backend.tags["tag"] == {"c"}
+    assert set(backend.key_tags) == {"c"}
+
+
+@pytest.mark.asyncio
+async def test_disabled_response_cache_compresses_at_dynamic_levels():
+    cache = ResponseCache()
+
+    async def build():
+        return {"features": list(range(100))}
+
+    payload = await cache.get_or_set("key", ["tag"], build, encoding="gzip")
+    assert orjson.loads(decompress(payload, "gzip"))["features"][-1] == 99
@@ -0,0 +1,67 @@
+from app.controllers.derived import derive_fields
+from app.controllers.segments import _patch_update, _with_derived_fields
+from app.schemas import PatchOperation
+
+
+def test_derive_fields_estimates_missing_car_counts():
+    segment = {
+        "geometry": {"type": "LineString", "coordinates": [[13.4, 52.5], [13.4, 52.6]]},
+        "properties": {
+            "subsegments": [
+                {"parking_allowed": True, "length_in_meters": 12, "alignment": None},
+                {
+                    "parking_allowed": True,
+                    "length_in_meters": 12,
+                    "alignment": "perpendicular",
+                },
+                {"parking_allowed": True, "length_in_meters": 12, "car_count": 3},
+                {"parking_allowed": True, "length_in_meters": None},
+                {"parking_allowed": False, "length_in_meters": 12},
+            ],
+        },
+    }
+    derive_fields([segment])
+
+    assert segment["bbox"] == [13.4, 52.5, 13.4, 52.6]
+    assert round(segment["properties"]["length_in_meters"]) == 11120
+    assert [
+        subsegment["estimated_car_count"]
+        for subsegment in segment["properties"]["subsegments"]
+    ] == [2, 4, None, None, None]
+
+
+def test_patch_stores_derived_fields_in_the_same_update():
+    segment = {
+        "geometry": {"type": "LineString", "coordinates": [[13.4, 52.5], [13.4, 52.6]]},
+        "properties": {
+            "version": 3,
+            "subsegments": [
+                {"order_number": 0, "parking_allowed": True, "length_in_meters": 12},
+                {"order_number": 1, "parking_allowed": False},
+            ],
+        },
+    }
+    update, array_filters, _ = _patch_update([
+        PatchOperation(
+            op="replace", path="/properties/subsegments/0/length_in_meters", value=30
+        ),
+        PatchOperation(
+            op="replace",
+            path="/properties/subsegments/0/alignment",
+            value="perpendicular",
+        ),
+        PatchOperation(
+            op="replace",
+            path="/geometry",
+            value={"type": "LineString", "coordinates": [[13.4, 52.5], [13.4, 52.55]]},
+        ),
+    ])
+    update, array_filters = _with_derived_fields(segment, update, array_filters)
+
+    assert update["$set"]["bbox"] == [13.4, 52.5, 13.4, 52.55]
+    assert round(update["$set"]["properties.length_in_meters"]) == 5560
+    # Both changes of subsegment 0 are set at once, with its new estimate
+    assert array_filters == [{"subsegment0.order_number": 0}]
+    subsegment = update["$set"]["properties.subsegments.$[subsegment0]"]
+    assert subsegment["alignment"] == "perpendicular"
+    assert subsegment["estimated_car_count"] == 12
@@ -0,0 +1,32 @@
+import httpx
+import pytest
+
+from app.services import EmailService, FakeTransport
+
+
+class FlakyTransport(FakeTransport):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    async def send(self, message: dict):
+        if self.failures:
+            self.failures -= 1
+            raise httpx.ConnectError("connection refused")
+        await super().send(message)
+
+
+@pytest.mark.asyncio
+async def test_email_service_retries_and_dedupes():
+    transport = FlakyTransport(failures=2)
+    email_service = EmailService(transport=transport, retry_backoff_seconds=0)
+
+    assert await email_service.send_email_verification_link("a@email.com", "token")
+    assert not await email_service.send_email_verification_link("a@email.com", "new")
+    assert await email_service.send_email_verification_link("b@email.com", "token")
+    await email_service.stop()
+
+    assert [message["to"] for message in transport.outbox] == [
+        ["a@email.com"],
+        ["b@email.com"],
+    ]
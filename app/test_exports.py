@@ -0,0 +1,85 @@
+import io
+from datetime import datetime
+
+import orjson
+import pyarrow.parquet as pq
+import shapely
+
+from app.controllers.exports import (
+    SEGMENT_SCHEMA,
+    SUBSEGMENT_SCHEMA,
+    segment_batch,
+    subsegment_batch,
+)
+
+segments = [
+    {
+        "_id": "a",
+        "geometry": {"type": "LineString", "coordinates": [[13.4, 52.5], [13.5, 52.6]]},
+        "properties": {
+            "owner_id": "owner",
+            "modified_at": datetime(2024, 1, 1),
+            "subsegments": [
+                {
+                    "parking_allowed": True,
+                    "street_location": "curb",
+                    "no_parking_reasons": ["tree", "unknown"],
+                },
+                {"parking_allowed": False, "order_number": 1, "car_count": 3},
+            ],
+        },
+    },
+    {
+        "_id": "b",
+        "geometry": {"type": "Point", "coordinates": [13.4, 52.5]},
+        "properties": {"subsegments": []},
+    },
+]
+
+
+def write(schema, batch) -> io.BytesIO:
+    sink = io.BytesIO()
+    with pq.ParquetWriter(sink, schema) as writer:
+        writer.write_batch(batch)
+    sink.seek(0)
+    return sink
+
+
+def test_segment_table_is_geoparquet():
+    table = pq.read_table(write(SEGMENT_SCHEMA, segment_batch(segments)))
+    assert orjson.loads(table.schema.metadata[b"geo"])["primary_column"] == "geometry"
+    assert table.column("subsegment_count").to_pylist() == [2, 0]
+    geometry = shapely.from_wkb(table.column("geometry")[0].as_py())
+    assert geometry.coords[0] == (13.4, 52.5)
+
+
+def test_subsegment_table_is_flat_and_dictionary_encoded():
+    table = pq.read_table(write(SUBSEGMENT_SCHEMA, subsegment_batch(segments)))
+    rows = table.to_pylist()
+    assert [row["segment_id"] for row in rows] == ["a", "a"]
+    assert [row["order_number"] for row in rows] == [0, 1]
+    assert rows[0]["street_location"] == "curb"
+    assert rows[0]["no_parking_reasons"] == ["tree", None]
+    assert table.schema.field("street_location").type.index_type.bit_width == 8
+
+
+def test_invalid_values_are_exported_as_null():
+    broken = [{
+        "_id": "c",
+        "geometry": {"type": "LineString", "coordinates": "broken"},
+        "properties": {
+            "version": "2",
+            "subsegments": [
+                {"car_count": "3", "parking_allowed": "yes", "fee": True},
+                {"car_count": 2, "no_parking_reasons": "tree"},
+            ],
+        },
+    }]
+    segment = segment_batch(broken).to_pylist()[0]
+    assert segment["geometry"] is None
+    assert segment["version"] is None
+    rows = subsegment_batch(broken).to_pylist()
+    assert [row["car_count"] for row in rows] == [None, 2]
+    assert rows[0]["parking_allowed"] is None
+    assert rows[0]["fee"] is True
+    assert rows[1]["no_parking_reasons"] == []
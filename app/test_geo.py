@@ -0,0 +1,139 @@
+import mapbox_vector_tile
+import numpy as np
+from shapely.geometry import Polygon, box
+
+from app.geo import (
+    SpatialIndex,
+    bounds_polygon,
+    buffered_tile_bounds,
+    encode_tile,
+    geodesic_cover,
+    geometry_lengths,
+    geometry_tiles,
+    lonlat_to_tile,
+    simplify_lines,
+    snap_bbox,
+    zoom_tolerance,
+)
+
+
+def test_simplify_lines_drops_collinear_points():
+    line = np.array([[0, 0], [1, 0.001], [2, 0], [3, 1], [4, 0]])
+    (simplified,) = simplify_lines([line], 0.01)
+    assert simplified.tolist() == [[0, 0], [2, 0], [3, 1], [4, 0]]
+
+
+def test_simplify_lines_batches_lines_independently():
+    lines = [
+        np.array([[0, 0], [1, 0]]),
+        np.array([[0, 0], [1, 5], [2, 0]]),
+        np.array([[0, 0], [1, 0.1], [2, 0]]),
+    ]
+    simplified = simplify_lines(lines, 1)
+    assert [len(line) for line in simplified] == [2, 3, 2]
+
+
+def test_zoom_tolerance_halves_per_zoom_level():
+    assert zoom_tolerance(10) == 2 * zoom_tolerance(11)
+
+
+def test_encode_tile_clips_to_tile():
+    z = 15
+    x, y = lonlat_to_tile(13.4330, 52.5479, z)
+    feature = {
+        "id": "segment",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [[13.4330, 52.5479], [13.6, 52.5479]],
+        },
+        "properties": {"has_subsegments": True, "subsegments": []},
+    }
+    tile = mapbox_vector_tile.decode(encode_tile([feature], z, x, y))
+    (decoded,) = tile["segments"]["features"]
+    assert decoded["properties"] == {"id": "segment", "has_subsegments": True}
+    assert all(
+        -64 <= coordinate <= 4096 + 64
+        for point in decoded["geometry"]["coordinates"]
+        for coordinate in point
+    )
+
+
+def test_snap_bbox_shares_range_for_small_pans():
+    def ring(west, south, east, north):
+        return [[west, south], [east, south], [east, north], [west, north]]
+
+    first = snap_bbox(ring(13.400, 52.500, 13.420, 52.510), 10, 16, 16)
+    panned = snap_bbox(ring(13.401, 52.501, 13.421, 52.511), 10, 16, 16)
+    assert first == panned
+    assert first.z == 14
+    assert snap_bbox(ring(0, 0, 100, 50), 10, 16, 16) is None
+
+
+def test_geometry_tiles_only_returns_touched_tiles():
+    diagonal = {"type": "LineString", "coordinates": [[13.40, 52.50], [13.5, 52.55]]}
+    tiles = geometry_tiles(diagonal, 14)
+    assert lonlat_to_tile(13.40, 52.50, 14) in tiles
+    assert lonlat_to_tile(13.5, 52.55, 14) in tiles
+    assert lonlat_to_tile(13.40, 52.55, 14) not in tiles
+
+
+def test_buffered_tile_bounds_stay_within_valid_coordinates():
+    west, _, _, north = buffered_tile_bounds(10, 0, 0, 64 / 4096)
+    assert west == -180
+    assert north <= 85.0511287798066
+    assert buffered_tile_bounds(10, 1023, 300, 64 / 4096)[2] == 180
+    assert buffered_tile_bounds(10, 1023, 1023, 64 / 4096)[1] >= -85.0511287798066
+
+
+def test_spatial_index_refines_and_follows_changes():
+    def line(x):
+        return {"type": "LineString", "coordinates": [[x, 0], [x + 1, 1]]}
+
+    index = SpatialIndex(rebuild_threshold=2)
+    index.build([(i, line(i), f"item {i}") for i in range(10)])
+    index.add("new", line(4.5), "new item")
+    index.add(3, line(20), "moved")
+    index.remove(2)
+    index.remove("missing")
+
+    # The bbox of segment 4 overlaps the area, the line itself does not
+    assert index.query(box(4.6, 0, 4.9, 0.2)) == ["new item"]
+    assert index.query(box(2.1, 0, 2.4, 0.5)) == []
+    assert index.query(box(19.5, 0, 21, 1)) == ["moved"]
+    assert len(index) == 10
+
+
+def test_geometry_lengths_are_geodesic():
+    # A tenth of a degree of latitude is about 11.1km anywhere
+    lengths = geometry_lengths([
+        {"type": "LineString", "coordinates": [[13.4, 52.5], [13.4, 52.6]]},
+        {"type": "Point", "coordinates": [13.4, 52.5]},
+        {"type": "MultiLineString", "coordinates": [
+            [[13.4, 52.5], [13.4, 52.55]], [[13.5, 52.5], [13.5, 52.55]]
+        ]},
+    ])
+    assert round(lengths[0]) == 11120
+    assert lengths[1] is None
+    assert round(lengths[2]) == 11120
+
+
+def test_geodesic_cover_arcs_enclose_the_planar_area():
+    def unit_vector(lon, lat):
+        lon, lat = np.radians([lon, lat])
+        return np.array([
+            np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)
+        ])
+
+    def arcs(ring):
+        """The ring with the great circle midpoint of every edge added."""
+        points = []
+        for a, b in zip(ring, ring[1:]):
+            x, y, z = unit_vector(*a) + unit_vector(*b)
+            midpoint = np.degrees([np.arctan2(y, x), np.arctan2(z, np.hypot(x, y))])
+            points += [a, midpoint.tolist()]
+        return Polygon(points)
+
+    area = box(5, 45, 15, 55)
+    # The southern edge of the plain bbox bulges north, into the area
+    assert not arcs(bounds_polygon(area.bounds)).contains(area)
+    assert arcs(geodesic_cover(area)).contains(area)
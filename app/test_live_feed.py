@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+import pytest
+
+from app.services import LiveFeed, Subscription
+from app.services.live_feed import PollWindow
+
+
+def segment(segment_id: str, lon: float, comment: str = "") -> dict:
+    return {
+        "_id": segment_id,
+        "geometry": {"type": "Point", "coordinates": [lon, 52.5]},
+        "properties": {"further_comments": comment},
+    }
+
+
+@pytest.mark.asyncio
+async def test_live_feed_filters_by_area_and_coalesces():
+    feed = LiveFeed(collection=None, deleted_collection=None)
+    inside = Subscription([[13.4, 52.4], [13.6, 52.4], [13.6, 52.6], [13.4, 52.4]])
+    outside = Subscription([[0, 0], [1, 0], [1, 1], [0, 0]])
+    feed.subscriptions.update([inside, outside])
+
+    feed.publish_document(segment("a", 13.5), "create")
+    feed.publish_document(segment("a", 13.5, "edited"), "update")
+    feed.publish_document(segment("b", 13.5), "update")
+    feed.publish_document(segment("b", 13.5), "delete")
+
+    events = await inside.next_batch(0)
+    assert [(event["id"], event["type"]) for event in events] == [
+        ("a", "create"), ("b", "delete")
+    ]
+    assert events[0]["feature"]["properties"]["further_comments"] == "edited"
+    assert outside.pending == {}
+
+
+@pytest.mark.asyncio
+async def test_live_feed_deletes_segments_moved_out_of_the_area():
+    feed = LiveFeed(collection=None, deleted_collection=None)
+    berlin = Subscription([[13.4, 52.4], [13.6, 52.4], [13.6, 52.6], [13.4, 52.4]])
+    feed.subscriptions.add(berlin)
+
+    feed.remember(segment("a", 13.5))
+    feed.publish_document(segment("a", 10), "update")
+    feed.publish_document(segment("b", 13.5), "update")
+    feed.publish_document(segment("b", 10), "update")
+
+    events = await berlin.next_batch(0)
+    assert [(event["id"], event["type"]) for event in events] == [
+        ("a", "delete"), ("b", "delete")
+    ]
+
+
+class Deletions:
+    def __init__(self):
+        self.documents = []
+
+    def find(self, query):
+        since = query["deleted_at"]["$gte"]
+        self.matches = [d for d in self.documents if d["deleted_at"] >= since]
+        return self
+
+    def sort(self, field, direction):
+        self.matches.sort(key=lambda document: document[field])
+        return self
+
+    async def __aiter__(self):
+        for document in self.matches:
+            yield document
+
+
+@pytest.mark.asyncio
+async def test_poll_window_finds_writes_stamped_late():
+    collection = Deletions()
+    window = PollWindow("deleted_at", lambda document: document["deleted_at"])
+    lookback = timedelta(seconds=10)
+
+    async def poll():
+        return [document["_id"] async for document in window.changes(
+            collection, lookback
+        )]
+
+    now = window.latest
+    collection.documents.append({"_id": "a", "deleted_at": now + timedelta(seconds=5)})
+    assert await poll() == ["a"]
+    # Written after a was read, by a process whose clock is behind
+    collection.documents.append({"_id": "b", "deleted_at": now + timedelta(seconds=2)})
+    assert await poll() == ["b"]
+    assert await poll() == []
@@ -0,0 +1,17 @@
+import pytest
+
+from app.services.rate_limit import MemoryBucketBackend, parse_limit
+
+
+def test_parse_limit():
+    assert parse_limit("5/minute") == (5, 5 / 60)
+
+
+@pytest.mark.asyncio
+async def test_memory_bucket_backend_empties_bucket():
+    backend = MemoryBucketBackend()
+    capacity, rate = parse_limit("2/hour")
+    assert await backend.take("ip", capacity, rate) == 0
+    assert await backend.take("ip", capacity, rate) == 0
+    assert await backend.take("ip", capacity, rate) == pytest.approx(30 * 60, rel=0.01)
+    assert await backend.take("other-ip", capacity, rate) == 0
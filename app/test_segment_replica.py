@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services import SegmentReplica
+
+
+def segment(segment_id: str, lon: float, modified_at: datetime) -> dict:
+    return {
+        "_id": segment_id,
+        "type": "Feature",
+        "geometry": {"type": "LineString", "coordinates": [[lon, 52.5], [lon, 52.6]]},
+        "properties": {
+            "modified_at": modified_at,
+            "subsegments": [{"order_number": 0}],
+        },
+    }
+
+
+def test_segment_replica_answers_summary_queries():
+    replica = SegmentReplica(collection=None, deleted_collection=None)
+    replica.ready = True
+    old = segment("old", 13.41, datetime(2024, 1, 1))
+    edited = segment("edited", 13.42, datetime(2024, 1, 1))
+    replica.apply([(None, old), (None, edited), (None, segment("gone", 13.43, None))])
+    replica.apply([
+        (edited, segment("edited", 13.42, datetime(2024, 3, 1))),
+        (segment("gone", 13.43, None), None),
+    ])
+    bbox = [[13.4, 52.5], [13.5, 52.5], [13.5, 52.6], [13.4, 52.6], [13.4, 52.5]]
+
+    features = replica.query(bbox)
+    assert sorted(feature["id"] for feature in features) == ["edited", "old"]
+    assert features[0]["properties"]["has_subsegments"]
+    assert features[0]["properties"]["subsegments"] == []
+
+    features = replica.query(
+        bbox,
+        exclude_ids=["old", "edited"],
+        include_if_modified_after=datetime(2024, 2, 1, tzinfo=timezone.utc),
+    )
+    assert [feature["id"] for feature in features] == ["edited"]
+
+    # Moved out of the bbox after the client's last sync
+    replica.apply([(old, segment("old", 14.5, datetime(2024, 3, 1)))])
+    features = replica.query(
+        bbox,
+        exclude_ids=["old", "edited"],
+        include_if_modified_after=datetime(2024, 2, 1, tzinfo=timezone.utc),
+    )
+    assert sorted(feature["id"] for feature in features) == ["edited", "old"]
+
+
+class Collection:
+    def __init__(self, *documents):
+        self.documents = list(documents)
+
+    def find(self, query=None):
+        if query:
+            ((field, condition),) = query.items()
+            self.matches = [
+                d for d in self.documents if timestamp(d, field) >= condition["$gte"]
+            ]
+        else:
+            self.matches = list(self.documents)
+        return self
+
+    def sort(self, field, direction):
+        self.matches.sort(key=lambda document: timestamp(document, field))
+        return self
+
+    async def __aiter__(self):
+        for document in self.matches:
+            yield document
+
+
+def timestamp(document: dict, field: str) -> datetime:
+    for key in field.split("."):
+        document = document[key]
+    return document
+
+
+@pytest.mark.asyncio
+async def test_segment_replica_reconciles_writes_stamped_late():
+    segments, tombstones = Collection(), Collection()
+    replica = SegmentReplica(segments, tombstones, lookback_seconds=10)
+    await replica.load()
+    loaded_at = replica.modified.latest
+
+    segments.documents.append(segment("a", 13.41, loaded_at + timedelta(seconds=5)))
+    await replica.reconcile()
+    # Written by a process whose clock is behind, after a was reconciled
+    segments.documents.append(segment("b", 13.42, loaded_at + timedelta(seconds=1)))
+    tombstones.documents.append(
+        {"_id": "a", "deleted_at": loaded_at + timedelta(seconds=2)}
+    )
+    segments.documents.pop(0)
+    await replica.reconcile()
+
+    bbox = [[13.4, 52.5], [13.5, 52.5], [13.5, 52.6], [13.4, 52.6], [13.4, 52.5]]
+    assert [feature["id"] for feature in replica.query(bbox)] == ["b"]
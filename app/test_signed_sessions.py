@@ -0,0 +1,36 @@
+import asyncio
+import base64
+
+import pytest
+
+from app.services import OneTimeAuth, RevocationList, SessionSigner
+
+
+def test_session_signer_rejects_other_tokens():
+    signer = SessionSigner(secret_key="secret")
+    user = {"id": "user", "email": "user@xtransform.org", "permission_level": 0}
+    assert signer.verify(signer.issue(user))["sub"] == "user"
+
+    # Magic link tokens are signed with the same key
+    magic_link = OneTimeAuth(secret_key="secret").generate_token(user["email"])
+    assert signer.verify(base64.b64decode(magic_link).decode()) is None
+
+
+class Revocations:
+    def __init__(self):
+        self.reads = 0
+
+    async def find(self):
+        self.reads += 1
+        await asyncio.sleep(0.01)
+        for revocation in [{"_id": "token"}]:
+            yield revocation
+
+
+@pytest.mark.asyncio
+async def test_revocation_list_reloads_once_for_queued_requests():
+    collection = Revocations()
+    revocations = RevocationList(collection, refresh_seconds=30)
+    await asyncio.gather(*(revocations.refresh() for _ in range(10)))
+    assert collection.reads == 1
+    assert revocations.token_ids == {"token"}
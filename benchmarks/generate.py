@@ -0,0 +1,188 @@
+"""
+Synthetic Berlin segments for benchmarks.
+
+Segments are short polylines placed inside the Ortsteil polygons, each
+with one to four subsegments drawn from the enums of the segment schema.
+The same seed always produces the same data.
+
+    python -m benchmarks.generate --count 50000 --clear
+    python -m benchmarks.generate --count 1000 --output segments.ndjson
+"""
+import argparse
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta
+from typing import List, Optional
+from uuid import UUID
+
+import numpy as np
+import orjson
+import shapely
+from shapely.geometry import LineString, shape
+
+from app.controllers.derived import derive_fields
+from app.controllers.segments import segment_collection
+from app.geo import line_lengths
+from app.schemas import segment as schema
+from app.tasks import count_clusters
+from app.tasks.load_clusters import ORTSTEILE_PATH
+
+# Degrees per meter at Berlin's latitude
+LAT_PER_METER = 1 / 111320
+LON_PER_METER = 1 / (111320 * math.cos(math.radians(52.5)))
+OWNER_ID = "benchmark"
+
+
+def _choice(rng: np.random.Generator, enum, allow_none: bool = True):
+    values = [member.value for member in enum] + ([None] if allow_none else [])
+    return values[rng.integers(len(values))]
+
+
+def _subsegment(rng: np.random.Generator, order_number: int, length: float) -> dict:
+    parking_allowed = bool(rng.random() < 0.7)
+    alignment = _choice(rng, schema.Alignment, allow_none=False)
+    subsegment = {
+        'parking_allowed': parking_allowed,
+        'order_number': order_number,
+        'length_in_meters': round(length, 1),
+        'car_count': None,
+        'quality': int(rng.integers(1, 3)),
+        'fee': None,
+        'street_location': None,
+        'marked': None,
+        'alignment': None,
+        'duration_constraint': None,
+        'user_restriction': None,
+        'user_restriction_reason': None,
+        'alternative_usage_reason': None,
+        'time_constraint': None,
+        'time_constraint_reason': None,
+        'duration_constraint_reason': None,
+        'no_parking_reasons': [],
+    }
+    if parking_allowed:
+        restricted = bool(rng.random() < 0.2)
+        subsegment.update(
+            car_count=int(length / 5.7) if rng.random() < 0.5 else None,
+            fee=bool(rng.random() < 0.4),
+            street_location=_choice(rng, schema.StreetLocation),
+            marked=bool(rng.random() < 0.5),
+            alignment=alignment,
+            duration_constraint=bool(rng.random() < 0.3),
+            user_restriction=restricted,
+            user_restriction_reason=(
+                _choice(rng, schema.UserRestriction, allow_none=False)
+                if restricted else None
+            ),
+            time_constraint=bool(rng.random() < 0.2),
+        )
+    else:
+        reasons = [member.value for member in schema.NoParkingReason]
+        count = int(rng.integers(1, 3))
+        subsegment.update(
+            no_parking_reasons=[
+                reasons[i] for i in rng.choice(len(reasons), count, replace=False)
+            ],
+            alternative_usage_reason=_choice(rng, schema.AlternativeUsageReason),
+        )
+    return subsegment
+
+
+def _line(rng: np.random.Generator, polygon, attempts: int = 20) -> Optional[list]:
+    """A street-like polyline of a few vertices lying inside polygon."""
+    west, south, east, north = polygon.bounds
+    for _ in range(attempts):
+        start = (rng.uniform(west, east), rng.uniform(south, north))
+        bearing = rng.uniform(0, 2 * math.pi)
+        points = [start]
+        for _ in range(int(rng.integers(1, 5))):
+            bearing += rng.normal(0, 0.2)
+            step = rng.uniform(15, 80)
+            x, y = points[-1]
+            points.append((
+                x + math.sin(bearing) * step * LON_PER_METER,
+                y + math.cos(bearing) * step * LAT_PER_METER,
+            ))
+        line = LineString(points)
+        if polygon.contains(line):
+            return [[round(x, 7), round(y, 7)] for x, y in points]
+    return None
+
+
+def generate_segments(count: int, seed: int = 0) -> List[dict]:
+    """count segments spread over the Ortsteile proportionally to their area."""
+    rng = np.random.default_rng(seed)
+    features = orjson.loads(ORTSTEILE_PATH.read_bytes())['features']
+    polygons = [shape(feature['geometry']) for feature in features]
+    areas = shapely.area(np.array(polygons, dtype=object))
+    weights = areas / areas.sum()
+    start = datetime(2021, 1, 1)
+
+    segments = []
+    while len(segments) < count:
+        polygon = polygons[rng.choice(len(polygons), p=weights)]
+        coordinates = _line(rng, polygon)
+        if coordinates is None:
+            continue
+        created_at = start + timedelta(minutes=int(rng.integers(0, 60 * 24 * 365)))
+        # Split the street evenly between the subsegments
+        length = float(line_lengths([coordinates])[0])
+        parts = int(rng.integers(1, 5))
+        segments.append({
+            '_id': str(UUID(bytes=rng.bytes(16), version=4)),
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': coordinates},
+            'properties': {
+                'owner_id': OWNER_ID,
+                'data_source': 'benchmark',
+                'further_comments': None,
+                'created_at': created_at,
+                'modified_at': created_at,
+                'version': 1,
+                'subsegments': [
+                    _subsegment(rng, order_number, length / parts)
+                    for order_number in range(parts)
+                ],
+            },
+        })
+    return segments
+
+
+async def load_segments(
+    segments: List[dict], clear: bool = False, chunk_size: int = 1000
+):
+    """Write segments to the configured Mongo, with their derived fields."""
+    if clear:
+        await segment_collection.delete_many({'properties.owner_id': OWNER_ID})
+    for offset in range(0, len(segments), chunk_size):
+        chunk = derive_fields(segments[offset:offset + chunk_size])
+        await segment_collection.insert_many(chunk, ordered=False)
+    await count_clusters()
+    logging.info(f"Loaded {len(segments)} segments")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", help="write newline delimited features instead of loading"
+    )
+    parser.add_argument(
+        "--clear", action="store_true", help="delete earlier benchmark segments"
+    )
+    args = parser.parse_args()
+
+    segments = generate_segments(args.count, args.seed)
+    if args.output:
+        with open(args.output, "wb") as file:
+            for segment in segments:
+                file.write(orjson.dumps(segment) + b"\n")
+    else:
+        asyncio.run(load_segments(segments, clear=args.clear))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,350 @@
+"""
+Benchmark scenarios for the hot paths, reported as JSON.
+
+Requests go to the app in process, or to a running server with --base-url.
+Load the synthetic segments with benchmarks.generate first. The replica
+scenario needs no database, it queries an in-memory SegmentReplica of
+freshly generated segments, so on its own it runs without MongoDB.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --scenario query_segments --base-url http://localhost:8023
+"""
+import argparse
+import asyncio
+import math
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, List, Optional
+
+import httpx
+import numpy as np
+import orjson
+
+from benchmarks.generate import (
+    LAT_PER_METER,
+    LON_PER_METER,
+    OWNER_ID,
+    generate_segments,
+)
+
+# Roughly the extent of Berlin
+BERLIN = (13.1, 52.35, 13.75, 52.65)
+BBOX_SIZES_METERS = {'street': 250, 'neighbourhood': 1000, 'district': 5000}
+SCENARIOS = ['query_segments', 'export', 'clusters', 'editing', 'replica']
+
+
+def random_bbox(rng: np.random.Generator, size_meters: float) -> List[List[float]]:
+    width = size_meters * LON_PER_METER
+    height = size_meters * LAT_PER_METER
+    west = rng.uniform(BERLIN[0], BERLIN[2] - width)
+    south = rng.uniform(BERLIN[1], BERLIN[3] - height)
+    east, north = west + width, south + height
+    return [[west, south], [east, south], [east, north], [west, north], [west, south]]
+
+
+def zoom_for(size_meters: float) -> int:
+    # A 1024px wide map showing size_meters
+    return int(math.log2(40075016 * math.cos(math.radians(52.5)) * 4 / size_meters))
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process, which includes the app only when in process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+async def measure(
+    name: str,
+    request: Callable[[int], Awaitable[Any]],
+    requests: int,
+    concurrency: int,
+    **parameters,
+) -> dict:
+    """Run request(i) for i in range(requests) on concurrency workers."""
+    latencies = []
+    errors = 0
+    indices = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in indices:
+            started = time.perf_counter()
+            try:
+                await request(index)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+    milliseconds = np.array(latencies) * 1000
+    return {
+        'scenario': name,
+        'parameters': parameters,
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'duration_seconds': round(duration, 3),
+        'throughput_rps': round(requests / duration, 1),
+        'latency_ms': {
+            'mean': round(float(milliseconds.mean()), 3),
+            **{
+                f'p{q}': round(float(np.percentile(milliseconds, q)), 3)
+                for q in (50, 90, 99)
+            },
+            'max': round(float(milliseconds.max()), 3),
+        },
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+async def _get(client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+    response = await client.get(url, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+async def _query(client: httpx.AsyncClient, bbox: List[List[float]], zoom: int):
+    response = await client.post(
+        '/query-segments/', json={'bbox': bbox, 'details': False, 'zoom': zoom}
+    )
+    response.raise_for_status()
+    return response
+
+
+async def query_segments_scenarios(client, args) -> List[dict]:
+    results = []
+    for label, size in BBOX_SIZES_METERS.items():
+        rng = np.random.default_rng(args.seed)
+        bboxes = [random_bbox(rng, size) for _ in range(args.requests)]
+        results.append(await measure(
+            'query_segments',
+            lambda i: _query(client, bboxes[i], zoom_for(size)),
+            args.requests,
+            args.concurrency,
+            bbox=label,
+            bbox_meters=size,
+        ))
+    return results
+
+
+async def export_scenarios(client, args) -> List[dict]:
+    # Full exports are heavy, a handful of them tells enough
+    requests = max(1, args.requests // 50)
+    return [await measure(
+        'export',
+        lambda i: _get(client, '/segments/', params={'format': format}),
+        requests,
+        1,
+        format=format,
+    ) for format in ('geojson', 'ndjson')]
+
+
+async def clusters_scenarios(client, args) -> List[dict]:
+    return [await measure(
+        'clusters',
+        lambda i: _get(client, '/clusters/'),
+        args.requests,
+        args.concurrency,
+    )]
+
+
+async def _edit(client: httpx.AsyncClient, segment_id: str, index: int):
+    response = await client.patch(
+        f'/segments/{segment_id}/',
+        json=[{
+            'op': 'replace',
+            'path': '/properties/further_comments',
+            'value': f'benchmark edit {index}',
+        }],
+    )
+    response.raise_for_status()
+
+
+async def editing_scenarios(client, args) -> List[dict]:
+    """
+    Mapping sessions: pan around a neighbourhood, editing every fifth step.
+
+    Only the synthetic segments of benchmarks.generate are edited, never
+    those of other owners, whatever the session may edit.
+    """
+    if not client.cookies:
+        return []
+    rng = np.random.default_rng(args.seed)
+    bboxes = [
+        random_bbox(rng, BBOX_SIZES_METERS['street']) for _ in range(args.requests)
+    ]
+    writes = rng.random(args.requests) < 0.2
+    seen: List[str] = []
+
+    async def step(i: int):
+        if writes[i] and seen:
+            await _edit(client, seen[i % len(seen)], i)
+            return
+        response = await _query(client, bboxes[i], 17)
+        seen.extend(
+            feature['id'] for feature in response.json()['features'][:5]
+            if feature['properties'].get('owner_id') == OWNER_ID
+        )
+
+    return [await measure(
+        'editing', step, args.requests, args.concurrency, write_share=0.2
+    )]
+
+
+async def replica_scenarios(client, args) -> List[dict]:
+    from app.services import SegmentReplica
+    from app.services.segment_replica import summarize
+
+    replica = SegmentReplica(collection=None, deleted_collection=None)
+    segments = generate_segments(args.replica_count, args.seed)
+    replica.index.build(
+        (segment['_id'], segment['geometry'], summarize(segment))
+        for segment in segments
+    )
+    replica.ready = True
+
+    async def query(bbox: List[List[float]]):
+        replica.query(bbox)
+
+    results = []
+    for label, size in BBOX_SIZES_METERS.items():
+        rng = np.random.default_rng(args.seed)
+        bboxes = [random_bbox(rng, size) for _ in range(args.requests)]
+        results.append(await measure(
+            'replica',
+            lambda i: query(bboxes[i]),
+            args.requests,
+            1,
+            bbox=label,
+            bbox_meters=size,
+            segments=len(segments),
+        ))
+    return results
+
+
+_scenarios = {
+    'query_segments': query_segments_scenarios,
+    'export': export_scenarios,
+    'clusters': clusters_scenarios,
+    'editing': editing_scenarios,
+    'replica': replica_scenarios,
+}
+
+
+async def _benchmark_session() -> str:
+    """A session of the guest user owning the synthetic segments."""
+    from app import controllers
+    from app.controllers.users import user_collection
+    from app.permissions import access_levels
+
+    user = await user_collection.find_one({'_id': OWNER_ID})
+    if user is None:
+        now = datetime.now()
+        user = {
+            '_id': OWNER_ID,
+            'email': f'{OWNER_ID}@benchmark.invalid',
+            'permission_level': access_levels['guest'],
+            'created_at': now,
+            'modified_at': now,
+        }
+        await user_collection.insert_one(user)
+    user['id'] = user['_id']
+    return await controllers.create_session(user=user)
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    from app.config import settings
+
+    results = []
+    if args.scenario == ['replica']:
+        results += await replica_scenarios(None, args)
+    elif args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+        if args.session:
+            client.cookies.set(settings.session_identifier, args.session)
+        async with client:
+            for scenario in args.scenario:
+                results += await _scenarios[scenario](client, args)
+        # The server runs elsewhere, only the client's memory is known here
+        for result in results:
+            if result['scenario'] != 'replica':
+                result['client_peak_rss_mb'] = result.pop('peak_rss_mb')
+    else:
+        import app.main  # noqa, registers the routers
+        from app.app import app
+
+        await app.router.startup()
+        try:
+            async with httpx.AsyncClient(
+                app=app, base_url='http://benchmark', timeout=60
+            ) as client:
+                if 'editing' in args.scenario:
+                    client.cookies.set(
+                        settings.session_identifier, await _benchmark_session()
+                    )
+                for scenario in args.scenario:
+                    results += await _scenarios[scenario](client, args)
+        finally:
+            await app.router.shutdown()
+
+    return {
+        'meta': {
+            'started_at': args.started_at,
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'target': args.base_url or 'in-process',
+            'seed': args.seed,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+        },
+        'results': results,
+        ('client_peak_rss_mb' if args.base_url else 'peak_rss_mb'): round(
+            peak_rss_mb(), 1
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--scenario', action='append', choices=SCENARIOS,
+        help='repeat to run several, defaults to all',
+    )
+    parser.add_argument('--base-url', help='benchmark a running server instead')
+    parser.add_argument('--session', help='session cookie for editing a server')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replica-count', type=int, default=20000)
+    parser.add_argument('--output', help='write the JSON report here, not stdout')
+    args = parser.parse_args()
+    args.scenario = args.scenario or SCENARIOS
+    args.started_at = datetime.now().isoformat()
+
+    report = orjson.dumps(asyncio.run(run(args)), option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, 'wb') as file:
+            file.write(report)
+    else:
+        sys.stdout.buffer.write(report + b'\n')
+
+
+if __name__ == '__main__':
+    main()